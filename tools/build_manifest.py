@@ -1,12 +1,20 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
 import hashlib
 import json
 import os
 import re
 import shutil
+import tempfile
+import time
 from pathlib import Path
 
+from fswatch import debounced_batches, open_watcher
+
+from metrics import METRICS, add_metrics_args, configure_metrics
+from phash import HASH_ALGOS, group_near_duplicates, hash_files
+
 
 IMAGE_EXTS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
 
@@ -235,46 +243,312 @@ def detect_color_hints(tokens: list[str]) -> list[str]:
     return sorted(colors)
 
 
-def build_manifest(src_root: Path, dest_assets: Path) -> list[dict]:
-    records: list[dict] = []
+def walk_images(src_root: Path) -> list[Path]:
+    paths: list[Path] = []
     for root, _, files in os.walk(src_root):
         for fname in files:
             ext = os.path.splitext(fname)[1].lower()
-            if ext not in IMAGE_EXTS:
-                continue
-            abs_path = Path(root) / fname
-            rel = abs_path.relative_to(src_root)
-            tokens = tokenize_path(rel)
-
-            category, top_layer = detect_category_and_toplayer(tokens)
-            if category is None:
-                # Skip completely unrecognized items to keep generator stable
+            if ext in IMAGE_EXTS:
+                paths.append(Path(root) / fname)
+    return paths
+
+
+def make_record(rel: Path) -> dict | None:
+    tokens = tokenize_path(rel)
+
+    category, top_layer = detect_category_and_toplayer(tokens)
+    if category is None:
+        # Skip completely unrecognized items to keep generator stable
+        return None
+
+    return {
+        "id": stable_id(str(rel)),
+        "name": rel.stem,
+        "category": category,
+        "topLayer": top_layer,  # base | overshirt for category==top
+        "file": f"assets/{rel.as_posix()}",
+        "colorHints": detect_color_hints(tokens),
+        "styleHints": detect_style_hints(tokens),
+    }
+
+
+def copy_asset(abs_path: Path, dest_path: Path) -> bool:
+    """Copy ``abs_path`` to ``dest_path`` if newer; False if the source is gone."""
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    # Copy file (no downscale)
+    try:
+        if not dest_path.exists() or os.path.getmtime(abs_path) > os.path.getmtime(dest_path):
+            shutil.copy2(abs_path, dest_path)
+            METRICS.add_file_read(abs_path)
+            METRICS.add_file_written(dest_path)
+            METRICS.add("files_copied")
+    except FileNotFoundError:
+        # Source deleted or renamed after it was listed
+        if not abs_path.exists():
+            return False
+        raise
+    return True
+
+
+def mark_duplicates(
+    records: list[dict],
+    src_root: Path,
+    mode: str,
+    algo: str = "dhash",
+    threshold: int = 6,
+    cache_path: Path | None = None,
+    vanished: set[str] | None = None,
+) -> list[dict]:
+    # Hash once per file, then cluster within each category + colour so a shoe
+    # never collapses into a tee, nor a navy polo into the black one (grayscale
+    # hashes cannot tell them apart). The biggest file of a group is canonical.
+    # Files deleted meanwhile are left out and added to ``vanished``.
+    by_rel = {r["file"][len("assets/"):]: r for r in records}
+    hashes = hash_files({rel: src_root / rel for rel in by_rel}, algo, cache_path)
+    sizes: dict[str, int] = {}
+    for rel in list(hashes):
+        try:
+            sizes[rel] = os.path.getsize(src_root / rel)
+        except FileNotFoundError:
+            del hashes[rel]
+    gone = {rel for rel in by_rel if rel not in sizes and not (src_root / rel).exists()}
+    if vanished is not None:
+        vanished |= gone
+    buckets: dict[tuple, dict[str, int]] = {}
+    for rel, h in hashes.items():
+        r = by_rel[rel]
+        buckets.setdefault((r["category"], r["topLayer"] or "", tuple(r["colorHints"])), {})[rel] = h
+
+    dropped: set[str] = set()
+    for cat_hashes in buckets.values():
+        for group in group_near_duplicates(cat_hashes, threshold, rank=lambda k: (-sizes[k], k)):
+            canonical = by_rel[group[0]]
+            for rel in group[1:]:
+                METRICS.add("duplicates_found")
+                if mode == "collapse":
+                    dropped.add(rel)
+                else:
+                    by_rel[rel]["duplicateOf"] = canonical["id"]
+    return [r for rel, r in by_rel.items() if rel not in dropped and rel not in gone]
+
+
+def build_manifest(
+    src_root: Path,
+    dest_assets: Path,
+    dedupe: str = "off",
+    dedupe_algo: str = "dhash",
+    dedupe_threshold: int = 6,
+    hash_cache: Path | None = None,
+) -> list[dict]:
+    records: list[dict] = []
+    with METRICS.stage("walk"):
+        paths = walk_images(src_root)
+    METRICS.add("files_seen", len(paths))
+    with METRICS.stage("classify"):
+        for abs_path in paths:
+            rec = make_record(abs_path.relative_to(src_root))
+            if rec is None:
+                METRICS.add("files_skipped")
                 continue
+            records.append(rec)
 
-            style_hints = detect_style_hints(tokens)
-            color_hints = detect_color_hints(tokens)
+    if dedupe != "off":
+        with METRICS.stage("dedupe"):
+            records = mark_duplicates(records, src_root, dedupe, dedupe_algo, dedupe_threshold, hash_cache)
 
+    with METRICS.stage("copy"):
+        copied = []
+        for rec in records:
+            rel = Path(rec["file"][len("assets/"):])
             # Compute destination path preserving folder structure
-            dest_path = dest_assets / rel
-            dest_path.parent.mkdir(parents=True, exist_ok=True)
-            # Copy file (no downscale)
-            if not dest_path.exists() or os.path.getmtime(abs_path) > os.path.getmtime(dest_path):
-                shutil.copy2(abs_path, dest_path)
-
-            item_id = stable_id(str(rel))
-            name = rel.stem
-
-            rec = {
-                "id": item_id,
-                "name": name,
-                "category": category,
-                "topLayer": top_layer,  # base | overshirt for category==top
-                "file": f"assets/{rel.as_posix()}",
-                "colorHints": color_hints,
-                "styleHints": style_hints,
-            }
-            records.append(rec)
-    return records
+            if copy_asset(src_root / rel, dest_assets / rel):
+                copied.append(rec)
+    return copied
+
+
+def sort_records(records: list[dict]) -> list[dict]:
+    # Sort records by category then name for determinism
+    return sorted(records, key=lambda r: (r["category"], r.get("topLayer") or "", r["name"]))
+
+
+def write_manifest(records: list[dict], manifest_path: Path) -> None:
+    # Write next to the target and rename so readers never see a partial file
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{manifest_path.name}.", suffix=".tmp", dir=manifest_path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2, ensure_ascii=False)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, manifest_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+    METRICS.add_file_written(manifest_path)
+
+
+class LiveManifest:
+    """In-memory record set kept in sync with the source tree by ``apply()``.
+
+    Assets are copied (and pruned) by ``write()`` once duplicates are
+    resolved, so ``dest`` ends up as a one-shot build would leave it.
+    ``events_processed`` counts dirty paths handled and ``batches`` the
+    debounced batches applied since start.
+    """
+
+    def __init__(self, src_root: Path, dest_assets: Path, manifest_path: Path, dedupe_opts: dict | None = None):
+        self.src_root = src_root
+        self.dest_assets = dest_assets
+        self.manifest_path = manifest_path
+        self.dedupe_opts = dedupe_opts
+        self.records: dict[str, dict] = {}
+        self.events_processed = 0
+        self.batches = 0
+        self._stats: dict[str, tuple[int, int]] = {}
+        self._changed: set[str] = set()
+        self._copied: set[str] = set()
+        self._written: list[dict] | None = None
+
+    def rescan(self) -> None:
+        seen = set()
+        for abs_path in walk_images(self.src_root):
+            seen.add(self._upsert(abs_path))
+        for key in [k for k in self.records if k not in seen]:
+            self._remove(key)
+
+    def _upsert(self, abs_path: Path) -> str:
+        rel = abs_path.relative_to(self.src_root)
+        key = rel.as_posix()
+        rec = make_record(rel)
+        if rec is None:
+            self._remove(key)
+            return key
+        try:
+            st = abs_path.stat()
+        except FileNotFoundError:
+            self._remove(key)
+            return key
+        stat = (st.st_mtime_ns, st.st_size)
+        if self.records.get(key) != rec or self._stats.get(key) != stat:
+            self.records[key] = rec
+            self._stats[key] = stat
+            self._changed.add(key)
+        return key
+
+    def _remove(self, key: str) -> None:
+        if self.records.pop(key, None) is not None:
+            self._stats.pop(key, None)
+            self._changed.add(key)
+
+    def _remove_tree(self, key: str) -> None:
+        self._remove(key)
+        prefix = key + "/"
+        for k in [k for k in self.records if k.startswith(prefix)]:
+            self._remove(k)
+
+    def apply(self, dirty: set[Path | None]) -> bool:
+        """Reconcile ``dirty`` paths; True if any record or image changed."""
+        self.batches += 1
+        self.events_processed += len(dirty)
+        METRICS.add("watch_events", len(dirty))
+        if None in dirty or self.src_root in dirty:
+            # Overflowed queue or the root itself moved: reconcile everything
+            self.rescan()
+            return bool(self._changed)
+        for path in sorted(dirty):
+            key = path.relative_to(self.src_root).as_posix()
+            if path.is_dir():
+                present = {p.relative_to(self.src_root).as_posix() for p in walk_images(path)}
+                for k in [k for k in self.records if k.startswith(key + "/") and k not in present]:
+                    self._remove(k)
+                for p in walk_images(path):
+                    self._upsert(p)
+            elif path.is_file():
+                if path.suffix.lower() in IMAGE_EXTS:
+                    self._upsert(path)
+            else:
+                self._remove_tree(key)
+        return bool(self._changed)
+
+    def write(self) -> bool:
+        if self._written is not None and not self._changed:
+            return False
+        records = [dict(r) for r in self.records.values()]
+        vanished: set[str] = set()
+        if self.dedupe_opts:
+            records = mark_duplicates(records, self.src_root, vanished=vanished, **self.dedupe_opts)
+        vanished |= self._sync_assets({r["file"][len("assets/"):] for r in records})
+        if vanished:
+            # Deleted while this batch ran: drop them now rather than wait for the event
+            records = [r for r in records if r["file"][len("assets/"):] not in vanished]
+            for key in vanished:
+                self.records.pop(key, None)
+                self._stats.pop(key, None)
+        records = sort_records(records)
+        wrote = records != self._written
+        if wrote:
+            write_manifest(records, self.manifest_path)
+            self._written = records
+        # Only now: a failed write leaves the changes pending for the next batch.
+        # A vanished canonical may still be named by duplicateOf, so redo those.
+        self._changed = vanished if self.dedupe_opts else set()
+        return wrote
+
+    def _sync_assets(self, keep: set[str]) -> set[str]:
+        # Copy new or edited survivors, drop assets that are gone or collapsed.
+        # Returns the keys whose source vanished before it could be copied.
+        vanished = set()
+        for key in keep:
+            if key in self._changed or key not in self._copied:
+                if copy_asset(self.src_root / key, self.dest_assets / key):
+                    self._copied.add(key)
+                else:
+                    vanished.add(key)
+        for key in self._copied - (keep - vanished):
+            with contextlib.suppress(FileNotFoundError):
+                (self.dest_assets / key).unlink()
+            self._copied.discard(key)
+        return vanished
+
+
+def own_output_file(path: Path, outputs: tuple[Path, ...]) -> bool:
+    # An output or the temp file it is written through (write_manifest, save_hash_cache)
+    return any(
+        path.parent == out.parent
+        and (path.name == out.name or path.name == f"{out.name}.tmp" or path.name.startswith(f".{out.name}."))
+        for out in outputs
+    )
+
+
+def watch(live: LiveManifest, debounce: float, poll_interval: float, force_poll: bool) -> None:
+    # Never watch our own output when dest, the manifest or the hash cache live under the source tree
+    outputs = (live.manifest_path,)
+    if live.dedupe_opts and live.dedupe_opts.get("cache_path") is not None:
+        outputs += (live.dedupe_opts["cache_path"],)
+    ignore = tuple(p for p in (live.dest_assets, *outputs) if live.src_root in p.parents)
+    watcher = open_watcher(live.src_root, IMAGE_EXTS, poll_interval=poll_interval, ignore=ignore, force_poll=force_poll)
+    print(f"Watching {live.src_root} ({type(watcher).__name__}); Ctrl-C to stop")
+    try:
+        for dirty in debounced_batches(watcher, debounce=debounce):
+            dirty = {p for p in dirty if p is None or not own_output_file(p, outputs)}
+            if not dirty:
+                continue
+            t0 = time.perf_counter()
+            try:
+                with METRICS.stage("watch_apply"):
+                    # Skip the stat + hash pass over the tree when nothing relevant moved
+                    wrote = live.apply(dirty) and live.write()
+            except Exception as e:
+                # Keep watching; pending changes are retried with the next batch
+                print(f"Batch failed: {type(e).__name__}: {e}")
+                continue
+            ms = (time.perf_counter() - t0) * 1000
+            status = "wrote manifest" if wrote else "no change"
+            print(f"[{live.events_processed} events] {len(dirty)} paths in {ms:.0f} ms, {len(live.records)} items, {status}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 
 def main():
@@ -282,7 +556,22 @@ def main():
     ap.add_argument("--source", required=True, help="Source folder with images")
     ap.add_argument("--dest", required=True, help="Destination assets folder under public")
     ap.add_argument("--manifest", required=True, help="Path to output manifest.json")
+    ap.add_argument(
+        "--dedupe",
+        choices=["off", "flag", "collapse"],
+        default="off",
+        help="Near-duplicate images: flag them with duplicateOf, or collapse them out of the manifest",
+    )
+    ap.add_argument("--dedupe-algo", choices=HASH_ALGOS, default="dhash", help="Perceptual hash for --dedupe")
+    ap.add_argument("--dedupe-threshold", type=int, default=6, help="Max hamming distance (of 64 bits) for --dedupe")
+    ap.add_argument("--hash-cache", default=None, help="Hash cache file (default: .phash-cache.json next to the manifest)")
+    ap.add_argument("--watch", action="store_true", help="Keep running and update the manifest as source files change")
+    ap.add_argument("--debounce", type=float, default=0.2, help="Seconds of quiet before applying a burst of changes (--watch)")
+    ap.add_argument("--poll-interval", type=float, default=1.0, help="Scan interval when inotify is unavailable (--watch)")
+    ap.add_argument("--force-poll", action="store_true", help="Use the polling watcher even where inotify works (--watch)")
+    add_metrics_args(ap)
     args = ap.parse_args()
+    configure_metrics(args)
 
     src_root = Path(args.source).expanduser().resolve()
     dest_assets = Path(args.dest).expanduser().resolve()
@@ -292,16 +581,46 @@ def main():
         raise SystemExit(f"Source folder not found: {src_root}")
 
     dest_assets.mkdir(parents=True, exist_ok=True)
-    records = build_manifest(src_root, dest_assets)
-
-    # Sort records by category then name for determinism
-    records.sort(key=lambda r: (r["category"], r.get("topLayer") or "", r["name"]))
-
-    manifest_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        json.dump(records, f, indent=2, ensure_ascii=False)
+    hash_cache = (
+        Path(args.hash_cache).expanduser().resolve()
+        if args.hash_cache
+        else manifest_path.parent / ".phash-cache.json"
+    )
+    if args.watch:
+        dedupe_opts = None
+        if args.dedupe != "off":
+            dedupe_opts = {
+                "mode": args.dedupe,
+                "algo": args.dedupe_algo,
+                "threshold": args.dedupe_threshold,
+                "cache_path": hash_cache,
+            }
+        live = LiveManifest(src_root, dest_assets, manifest_path, dedupe_opts)
+        with METRICS.stage("walk"):
+            live.rescan()
+        with METRICS.stage("write_manifest"):
+            live.write()
+        print(f"Wrote manifest with {len(live.records)} items -> {manifest_path}")
+        watch(live, args.debounce, args.poll_interval, args.force_poll)
+        print(f"Stopped after {live.events_processed} events in {live.batches} batches")
+        METRICS.finish(args.metrics_out)
+        return
+
+    records = build_manifest(
+        src_root,
+        dest_assets,
+        dedupe=args.dedupe,
+        dedupe_algo=args.dedupe_algo,
+        dedupe_threshold=args.dedupe_threshold,
+        hash_cache=hash_cache,
+    )
+    records = sort_records(records)
+
+    with METRICS.stage("write_manifest"):
+        write_manifest(records, manifest_path)
 
     print(f"Wrote manifest with {len(records)} items -> {manifest_path}")
+    METRICS.finish(args.metrics_out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+
+# inotify(7) masks
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Recursive inotify watch on a tree, reporting dirty absolute paths.
+
+    A path is reported when it (or, for directories, anything below it) may
+    have changed; callers reconcile by looking at the filesystem again. Only
+    directories and files with an extension in ``exts`` are reported, and
+    nothing at or below an ``ignore`` path. A ``None`` entry means the kernel
+    queue overflowed and everything is dirty.
+    """
+
+    def __init__(self, root: Path, exts: set[str], ignore: tuple[Path, ...] = ()):
+        libc_name = ctypes.util.find_library("c")
+        if not sys.platform.startswith("linux") or not libc_name:
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.exts = exts
+        self.ignore = ignore
+        self._dirs: dict[int, Path] = {}
+        self._add_tree(root)
+
+    def _ignored(self, path: Path) -> bool:
+        return any(path == p or p in path.parents for p in self.ignore)
+
+    def _add_dir(self, path: Path) -> None:
+        if self._ignored(path):
+            return
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            # Raced with a delete, or hit max_user_watches: the parent still reports it
+            return
+        self._dirs[wd] = path
+
+    def _add_tree(self, root: Path) -> None:
+        self._add_dir(root)
+        for dirpath, dirnames, _ in os.walk(root):
+            for d in dirnames:
+                self._add_dir(Path(dirpath) / d)
+
+    def poll(self, timeout: float | None) -> list[Path | None]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        dirty: list[Path | None] = []
+        off = 0
+        while off < len(buf):
+            wd, mask, _cookie, length = _EVENT.unpack_from(buf, off)
+            off += _EVENT.size
+            name = buf[off:off + length].rstrip(b"\0")
+            off += length
+            if mask & IN_Q_OVERFLOW:
+                dirty.append(None)
+                continue
+            base = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            if base is None:
+                continue
+            path = base / os.fsdecode(name) if name else base
+            if self._ignored(path):
+                continue
+            if name and not mask & IN_ISDIR and os.path.splitext(path.name)[1].lower() not in self.exts:
+                # Sidecar files (.DS_Store, caches, editor temp files) never touch the manifest
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # Files may land before the new watch exists; the caller rescans the dir
+                self._add_tree(path)
+            dirty.append(path)
+        return dirty
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback watcher comparing (mtime, size) snapshots every ``interval``."""
+
+    def __init__(self, root: Path, exts: set[str], interval: float = 1.0, ignore: tuple[Path, ...] = ()):
+        self.root = root
+        self.exts = exts
+        self.interval = interval
+        self.ignore = ignore
+        self._snapshot = self._scan()
+        self._next = time.monotonic() + interval
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        snap: dict[Path, tuple[int, int]] = {}
+        stack = [self.root]
+        while stack:
+            d = stack.pop()
+            try:
+                it = os.scandir(d)
+            except OSError:
+                continue
+            with it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            p = Path(e.path)
+                            if p not in self.ignore:
+                                stack.append(p)
+                        elif os.path.splitext(e.name)[1].lower() in self.exts and Path(e.path) not in self.ignore:
+                            st = e.stat()
+                            snap[Path(e.path)] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        continue
+        return snap
+
+    def poll(self, timeout: float | None) -> list[Path | None]:
+        wait = self._next - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(max(0.0, timeout))
+            return []
+        time.sleep(max(0.0, wait))
+        self._next = time.monotonic() + self.interval
+        snap = self._scan()
+        old = self._snapshot
+        self._snapshot = snap
+        dirty: list[Path | None] = [p for p in snap.keys() - old.keys()]
+        dirty.extend(p for p in old.keys() - snap.keys())
+        dirty.extend(p for p in snap.keys() & old.keys() if snap[p] != old[p])
+        return dirty
+
+    def close(self) -> None:
+        pass
+
+
+def open_watcher(
+    root: Path,
+    exts: set[str],
+    poll_interval: float = 1.0,
+    ignore: tuple[Path, ...] = (),
+    force_poll: bool = False,
+):
+    if not force_poll:
+        try:
+            return InotifyWatcher(root, exts, ignore=ignore)
+        except OSError as e:
+            print(f"inotify unavailable ({e}); polling every {poll_interval:g}s")
+    return PollingWatcher(root, exts, interval=poll_interval, ignore=ignore)
+
+
+def debounced_batches(watcher, debounce: float = 0.2, max_delay: float = 1.0):
+    """Yield sets of dirty paths once events have been quiet for ``debounce``
+    seconds, or ``max_delay`` after the first event of a continuous burst.
+    """
+    while True:
+        pending: set[Path | None] = set(watcher.poll(None))
+        if not pending:
+            continue
+        started = time.monotonic()
+        while True:
+            remaining = max_delay - (time.monotonic() - started)
+            if remaining <= 0:
+                break
+            more = watcher.poll(min(debounce, remaining))
+            if not more:
+                break
+            pending.update(more)
+        yield pending
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 import argparse
-import json
+import functools
+import math
 import os
 import subprocess
 import tempfile
 import time
 from pathlib import Path
+from typing import Iterable, Iterator
+
+from metrics import METRICS, add_metrics_args, configure_metrics
+from snapshot import load_records
 
 try:
     from PIL import Image
@@ -24,8 +29,8 @@ CATEGORY_TITLES = {
 
 
 def read_manifest(manifest_path: Path) -> list[dict]:
-    with open(manifest_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    # Accepts manifest.json or a binary snapshot (tools/snapshot.py)
+    return load_records(manifest_path)
 
 
 def rgba_average_color(image_path: Path) -> tuple[float, float, float]:
@@ -33,6 +38,8 @@ def rgba_average_color(image_path: Path) -> tuple[float, float, float]:
         # Fallback: neutral mid-gray if Pillow not available
         return (0.5, 0.5, 0.5)
     im = Image.open(image_path).convert("RGBA")
+    METRICS.add("image_decodes")
+    METRICS.add_file_read(image_path)
     # Downsample for speed
     im = im.copy()
     im.thumbnail((128, 128))
@@ -122,7 +129,8 @@ def best_color_label(item: dict, assets_root: Path) -> tuple[str, tuple[float, f
             return c, None
     # Otherwise sample average color of the image
     img_path = assets_root / Path(item["file"])  # already assets/... relative
-    rgb = rgba_average_color(img_path)
+    with METRICS.stage("color_sampling"):
+        rgb = rgba_average_color(img_path)
     bucket = color_bucket_name(rgb)
     return bucket, rgb
 
@@ -160,9 +168,93 @@ def tex_escape(s: str) -> str:
     )
 
 
-def build_latex(buckets: dict[str, list[dict]], assets_root: Path) -> str:
-    # Landscape, white, mono; fixed square cells grid per category page
-    pre = r"""
+# A4 landscape with 10mm margins, symmetric spacing between square cells
+GAP_MM = 6.0
+TEXTWIDTH_MM = 297.0 - 2 * 10.0
+TEXTHEIGHT_MM = 210.0 - 2 * 10.0
+HEADER_MM = 6.0
+MIN_COLS = 2
+DEFAULT_MIN_CELL_MM = 30.0
+
+
+def cell_size(cols: int, rows: int) -> float:
+    cw = (TEXTWIDTH_MM - GAP_MM * (cols - 1)) / cols
+    ch = (TEXTHEIGHT_MM - GAP_MM * (rows - 1)) / rows
+    return min(cw, ch)
+
+
+def max_fit(length_mm: float, min_cell_mm: float) -> int:
+    # Largest k with k * cell + (k - 1) * gap <= length
+    return max(1, int((length_mm + GAP_MM) // (min_cell_mm + GAP_MM)))
+
+
+@functools.lru_cache(maxsize=None)
+def best_grid(n_items: int, min_cell_mm: float = DEFAULT_MIN_CELL_MM) -> tuple[int, int, float]:
+    # For each column count the row count is forced (ceil(n / cols)), so one
+    # pass over the few feasible column counts finds the largest square cell.
+    best: tuple[int, int, float] | None = None
+    max_cols = max(MIN_COLS, max_fit(TEXTWIDTH_MM, min_cell_mm))
+    for cols in range(MIN_COLS, max_cols + 1):
+        rows = max(1, math.ceil(n_items / cols))
+        cell = cell_size(cols, rows)
+        if cell <= 0:
+            continue
+        if best is None or cell > best[2]:
+            best = (cols, rows, cell)
+        if rows == 1:
+            break  # more columns only shrink the cell from here on
+    return best
+
+
+def paginate(n_items: int, min_cell_mm: float = DEFAULT_MIN_CELL_MM) -> tuple[int, int]:
+    """Return (pages, items per page) keeping every cell >= min_cell_mm.
+
+    Pages are balanced so a category of 41 on a 40-cell page becomes 21 + 20
+    rather than 40 + 1.
+    """
+    cap = max(1, max_fit(TEXTWIDTH_MM, min_cell_mm)) * max_fit(TEXTHEIGHT_MM, min_cell_mm)
+    pages = max(1, math.ceil(n_items / cap))
+    return pages, math.ceil(n_items / pages)
+
+
+def iter_grid_page(title: str, items: list[dict], cols: int, rows: int, cell_mm_raw: float) -> Iterator[str]:
+    # Minimal title line (monospace), much lower vertical footprint than \section*
+    yield f"\\noindent\\small\\texttt{{{tex_escape(title)}}}\\par\\vspace*{{2mm}}\n"
+    cell_mm = max(1.0, cell_mm_raw - 1.5)  # reduce to account for title line as well
+    rows = min(rows, math.ceil(len(items) / cols))
+    used_h = rows * cell_mm + (rows - 1) * GAP_MM + HEADER_MM
+    top_pad = max(0.0, (TEXTHEIGHT_MM - used_h) / 2)
+    yield f"\\vspace*{{{top_pad:.2f}mm}}\\\n"
+    # Render grid rows centered horizontally
+    for r in range(rows):
+        row_items = items[r * cols:(r + 1) * cols]
+        if not row_items:
+            break
+        line_cells: list[str] = []
+        for it in row_items:
+            path = tex_escape(it["file"])  # assets/... relative to public
+            # Small description under each image (name, hyphens turned to spaces)
+            label = tex_escape(it["name"].replace('-', ' '))
+            line_cells.append(
+                f"\\begin{{minipage}}[c][{cell_mm:.2f}mm][c]{{{cell_mm:.2f}mm}}\\centering\n"
+                f"\\includegraphics[width={cell_mm:.2f}mm,height={cell_mm:.2f}mm,keepaspectratio]{{{path}}}\\\\\n"
+                f"\\vspace*{{0.8mm}}\\tiny {label}\\\n"
+                f"\\end{{minipage}}"
+            )
+        row_tex = (f" \\hspace*{{{GAP_MM:.2f}mm}} ").join(line_cells)
+        yield f"\\makebox[\\textwidth][c]{{{row_tex}}}\\\n"
+        if r < rows - 1:
+            yield f"\\vspace*{{{GAP_MM:.2f}mm}}\\\n"
+    yield "\\newpage\n"
+
+
+def iter_latex(
+    buckets: dict[str, list[dict]],
+    assets_root: Path,
+    min_cell_mm: float = DEFAULT_MIN_CELL_MM,
+) -> Iterator[str]:
+    # Landscape, white, mono; square cells grid, paginated per category
+    yield r"""
 \documentclass[10pt]{article}
 \usepackage[landscape,margin=10mm]{geometry}
 \usepackage{graphicx}
@@ -174,7 +266,6 @@ def build_latex(buckets: dict[str, list[dict]], assets_root: Path) -> str:
 \graphicspath{{./}{../}}
 \begin{document}
 """
-    body_parts = []
 
     def sort_by_color(items: list[dict]) -> list[dict]:
         enriched = []
@@ -185,82 +276,44 @@ def build_latex(buckets: dict[str, list[dict]], assets_root: Path) -> str:
         enriched.sort(key=lambda x: (x[0], x[1], x[2]["name"]))
         return [it for _, _, it in enriched]
 
-    # Compute optimal square grid per page (A4 landscape), using symmetric spacing
-    gap_mm = 6.0
-    textwidth_mm = 297.0 - 2 * 10.0
-    textheight_mm = 210.0 - 2 * 10.0
-
-    def best_grid(n_items: int) -> tuple[int, int, float]:
-        best: tuple[int, int, float] | None = None
-        # Expand search space so everything can fit on one slide
-        for cols in range(2, 11):
-            for rows in range(1, 9):
-                cap = cols * rows
-                if cap < n_items:
-                    continue
-                cw = (textwidth_mm - gap_mm * (cols - 1)) / cols
-                ch = (textheight_mm - gap_mm * (rows - 1)) / rows
-                cell = min(cw, ch)
-                if cell <= 0:
-                    continue
-                if best is None or cell > best[2]:
-                    best = (cols, rows, cell)
-        if best is None:
-            # fallback 5x3
-            fallback = min((textwidth_mm - gap_mm * 4) / 5, (textheight_mm - gap_mm * 2) / 3)
-            return (5, 3, fallback)
-        return best
-
     for key in ["top_base", "top_overshirt", "outerwear", "bottom", "shoes", "accessory"]:
         items = buckets.get(key, [])
         if not items:
             continue
         title = CATEGORY_TITLES.get(key, key.title())
-        # Minimal title line (monospace), much lower vertical footprint than \section*
-        body_parts.append(f"\\noindent\\small\\texttt{{{tex_escape(title)}}}\\par\\vspace*{{2mm}}\n")
         ordered = sort_by_color(items)
-        # Single page per category: pick a grid that fits all items
-        cols, rows, cell_mm_raw = best_grid(len(ordered))
-        cell_mm = max(1.0, cell_mm_raw - 1.5)  # reduce to account for title line as well
-        header_mm = 6.0
-        used_h = rows * cell_mm + (rows - 1) * gap_mm + header_mm
-        top_pad = max(0.0, (textheight_mm - used_h) / 2)
-        body_parts.append(f"\\vspace*{{{top_pad:.2f}mm}}\\\n")
-        # Render grid rows centered horizontally
-        for r in range(rows):
-            row_items = ordered[r * cols:(r + 1) * cols]
-            if not row_items:
-                break
-            line_cells: list[str] = []
-            for it in row_items:
-                path = tex_escape(it["file"])  # assets/... relative to public
-                # Small description under each image (name, hyphens turned to spaces)
-                label = tex_escape(it["name"].replace('-', ' '))
-                line_cells.append(
-                    f"\\begin{{minipage}}[c][{cell_mm:.2f}mm][c]{{{cell_mm:.2f}mm}}\\centering\n"
-                    f"\\includegraphics[width={cell_mm:.2f}mm,height={cell_mm:.2f}mm,keepaspectratio]{{{path}}}\\\\\n"
-                    f"\\vspace*{{0.8mm}}\\tiny {label}\\\n"
-                    f"\\end{{minipage}}"
-                )
-            row_tex = (f" \\hspace*{{{gap_mm:.2f}mm}} ").join(line_cells)
-            body_parts.append(f"\\makebox[\\textwidth][c]{{{row_tex}}}\\\n")
-            if r < rows - 1:
-                body_parts.append(f"\\vspace*{{{gap_mm:.2f}mm}}\\\n")
-        body_parts.append("\\newpage\n")
-
-    post = "\\end{document}\n"
-    return pre + "".join(body_parts) + post
-
-
-def compile_pdf(tex_content: str, output_dir: Path) -> Path:
+        pages, per_page = paginate(len(ordered), min_cell_mm)
+        # Same grid on every page of a category so cells line up when flipping
+        cols, rows, cell_mm_raw = best_grid(per_page, min_cell_mm)
+        for page in range(pages):
+            page_title = title if pages == 1 else f"{title} ({page + 1}/{pages})"
+            page_items = ordered[page * per_page:(page + 1) * per_page]
+            yield from iter_grid_page(page_title, page_items, cols, rows, cell_mm_raw)
+
+    yield "\\end{document}\n"
+
+
+def build_latex(buckets: dict[str, list[dict]], assets_root: Path, min_cell_mm: float = DEFAULT_MIN_CELL_MM) -> str:
+    return "".join(iter_latex(buckets, assets_root, min_cell_mm))
+
+
+def compile_pdf(tex_content: str | Iterable[str], output_dir: Path) -> Path:
     ts = time.strftime("%Y%m%d-%H%M%S")
     output_dir.mkdir(parents=True, exist_ok=True)
     tex_path = output_dir / f"catalog-{ts}.tex"
     pdf_path = output_dir / f"catalog-{ts}.pdf"
-    with open(tex_path, "w", encoding="utf-8") as f:
-        f.write(tex_content)
+    if isinstance(tex_content, str):
+        tex_content = [tex_content]
+    with METRICS.stage("latex"), open(tex_path, "w", encoding="utf-8") as f:
+        # Fragments are written as they are produced; the document is never joined in memory
+        for fragment in tex_content:
+            f.write(fragment)
+    METRICS.add_file_written(tex_path)
     # Compile with pdflatex (twice not necessary here)
-    proc = subprocess.run(["pdflatex", "-interaction=nonstopmode", tex_path.name], cwd=str(output_dir))
+    with METRICS.stage("pdflatex"):
+        proc = subprocess.run(["pdflatex", "-interaction=nonstopmode", tex_path.name], cwd=str(output_dir))
+        if pdf_path.exists():
+            METRICS.add_file_written(pdf_path)
     # Even if returncode != 0, keep going if PDF exists (warnings sometimes set non-zero)
     if not pdf_path.exists():
         raise SystemExit(f"pdflatex failed (code {proc.returncode}) and no PDF generated")
@@ -269,20 +322,30 @@ def compile_pdf(tex_content: str, output_dir: Path) -> Path:
 
 def main():
     ap = argparse.ArgumentParser(description="Generate a PDF catalog from manifest.json")
-    ap.add_argument("--manifest", required=True, help="Path to manifest.json")
+    ap.add_argument("--manifest", required=True, help="Path to manifest.json or a .snap snapshot")
     ap.add_argument("--public", required=True, help="Path to public directory (for assets)")
     ap.add_argument("--outdir", required=True, help="Output directory for the PDF")
+    ap.add_argument(
+        "--min-cell-mm",
+        type=float,
+        default=DEFAULT_MIN_CELL_MM,
+        help="Smallest image cell before a category spills onto another page",
+    )
+    add_metrics_args(ap)
     args = ap.parse_args()
+    configure_metrics(args)
 
     manifest_path = Path(args.manifest).expanduser().resolve()
     public_dir = Path(args.public).expanduser().resolve()
     out_dir = Path(args.outdir).expanduser().resolve()
 
-    items = read_manifest(manifest_path)
-    buckets = categorize_items(items)
-    tex = build_latex(buckets, public_dir / "assets")
-    pdf = compile_pdf(tex, out_dir)
+    with METRICS.stage("read_manifest"):
+        items = read_manifest(manifest_path)
+        METRICS.add_file_read(manifest_path)
+        buckets = categorize_items(items)
+    pdf = compile_pdf(iter_latex(buckets, public_dir / "assets", args.min_cell_mm), out_dir)
     print(f"Wrote {pdf}")
+    METRICS.finish(args.metrics_out)
 
 
 if __name__ == "__main__":
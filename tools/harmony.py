@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from generate_catalog_pdf import COLOR_ORDER, best_color_label
+from metrics import METRICS, add_metrics_args, configure_metrics
+from rotation import SLOTS, Wardrobe
+from snapshot import load_records
+
+try:
+    import numpy as np
+except Exception as e:  # pragma: no cover
+    sys.stderr.write(
+        "NumPy is required. Install with: pip install numpy\n"
+    )
+    raise
+
+
+# Reference sRGB (0-255) for the colour names build_manifest / color_bucket_name emit
+NAMED_RGB = {
+    "black": (24, 24, 24),
+    "white": (245, 245, 242),
+    "grey": (128, 128, 128),
+    "navy": (31, 40, 78),
+    "beige": (214, 196, 162),
+    "cream": (240, 230, 205),
+    "tan": (193, 154, 107),
+    "khaki": (170, 160, 112),
+    "brown": (108, 72, 46),
+    "olive": (108, 110, 52),
+    "green": (62, 112, 64),
+    "denim": (82, 106, 140),
+    "blue": (48, 92, 170),
+    "purple": (108, 62, 140),
+    "magenta": (178, 52, 128),
+    "red": (176, 40, 42),
+    "orange": (222, 120, 42),
+    "yellow": (226, 198, 64),
+    "other": (128, 128, 128),
+}
+
+NEUTRAL_CHROMA = 20.0  # Lab chroma under which a colour anchors anything (beige, cream, greys)
+
+
+def srgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """(n, 3) sRGB in 0..1 -> (n, 3) CIE Lab (D65)."""
+    c = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    m = np.array([
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ])
+    xyz = c @ m.T / np.array([0.95047, 1.0, 1.08883])
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([116 * f[:, 1] - 16, 500 * (f[:, 0] - f[:, 1]), 200 * (f[:, 1] - f[:, 2])], axis=1)
+
+
+def hint_label(item: dict) -> str | None:
+    """Colour name for ``item`` from its colorHints: COLOR_ORDER precedence
+    first, then any other name in NAMED_RGB (olive, khaki, cream, ...)."""
+    hints = [c.lower() for c in (item.get("colorHints") or [])]
+    for c in COLOR_ORDER:
+        if c != "other" and c in hints:
+            return c
+    return next((c for c in hints if c in NAMED_RGB and c != "other"), None)
+
+
+def item_colors(items: list[dict], public_dir: Path | None) -> np.ndarray:
+    """Lab vector per item: colorHints when present, else the sampled image colour."""
+    rgb = np.empty((len(items), 3))
+    for i, it in enumerate(items):
+        label, sampled = hint_label(it), None
+        if label is None and public_dir is not None:
+            label, sampled = best_color_label(it, public_dir)
+        if sampled is not None:
+            rgb[i] = sampled
+        else:
+            rgb[i] = np.array(NAMED_RGB.get(label, NAMED_RGB["other"])) / 255.0
+    return srgb_to_lab(rgb)
+
+
+def harmony_matrix(lab: np.ndarray) -> np.ndarray:
+    """Item x item pair scores in [0, 1].
+
+    Neutrals (low chroma) pair with anything; chromatic pairs score by hue
+    distance with analogous (~0 deg), complementary (~180 deg) and triadic
+    (~120 deg) peaks; two different near-black/navy darks are penalised, the
+    same clash docs/main.js blacklists for navy/blue + black.
+    """
+    L, a, b = lab[:, 0], lab[:, 1], lab[:, 2]
+    chroma = np.hypot(a, b)
+    hue = np.degrees(np.arctan2(b, a)) % 360.0
+    dh = np.abs(hue[:, None] - hue[None, :])
+    dh = np.minimum(dh, 360.0 - dh)
+    dl = np.abs(L[:, None] - L[None, :])
+
+    hue_score = np.maximum.reduce([
+        0.9 * np.exp(-((dh / 25.0) ** 2)),  # analogous
+        1.0 * np.exp(-(((dh - 180.0) / 30.0) ** 2)),  # complementary
+        0.6 * np.exp(-(((dh - 120.0) / 20.0) ** 2)),  # triadic
+    ])
+    hue_score = 0.2 + 0.8 * hue_score
+
+    neutral = chroma < NEUTRAL_CHROMA
+    any_neutral = neutral[:, None] | neutral[None, :]
+    both_neutral = neutral[:, None] & neutral[None, :]
+    # Neutral anchors: reward some lightness contrast so grey-on-grey isn't top
+    anchor = 0.75 + 0.25 * np.minimum(dl / 40.0, 1.0)
+    score = np.where(any_neutral, anchor, hue_score)
+    score = np.where(both_neutral, 0.65 + 0.3 * np.minimum(dl / 50.0, 1.0), score)
+
+    dark = L < 30.0
+    de = np.sqrt(((lab[:, None, :] - lab[None, :, :]) ** 2).sum(axis=2))
+    dark_clash = dark[:, None] & dark[None, :] & (de > 6.0) & (de < 30.0)
+    score = np.where(dark_clash, 0.15, score)
+    np.fill_diagonal(score, 1.0)
+    return score
+
+
+def score_outfits(matrix: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """Mean pairwise harmony of each row of ``candidates`` (K, S) item indices.
+
+    ``-1`` marks an empty slot and is left out of the mean.
+    """
+    k, s = candidates.shape
+    iu, ju = np.triu_indices(s, 1)
+    a = candidates[:, iu]
+    b = candidates[:, ju]
+    valid = (a >= 0) & (b >= 0)
+    pair = matrix[np.where(valid, a, 0), np.where(valid, b, 0)]
+    n = valid.sum(axis=1)
+    return np.where(n > 0, (pair * valid).sum(axis=1) / np.maximum(n, 1), 0.0)
+
+
+def candidate_outfits(pools: list[list[int]], limit: int, rng: np.random.Generator) -> np.ndarray:
+    """Every combination of the slot pools, or ``limit`` random ones if larger."""
+    sizes = [max(1, len(p)) for p in pools]
+    arrays = [np.array(p if p else [-1]) for p in pools]
+    total = int(np.prod(sizes, dtype=np.float64))
+    if total <= limit:
+        grids = np.meshgrid(*[np.arange(n) for n in sizes], indexing="ij")
+        picks = [g.ravel() for g in grids]
+    else:
+        picks = [rng.integers(0, n, size=limit) for n in sizes]
+    return np.stack([arr[p] for arr, p in zip(arrays, picks)], axis=1)
+
+
+def top_k_outfits(
+    wardrobe: Wardrobe,
+    matrix: np.ndarray,
+    slots: tuple[str, ...],
+    k: int,
+    limit: int = 200_000,
+    seed: int = 0,
+) -> list[tuple[float, list[int]]]:
+    pools = [wardrobe.pools[s] for s in slots]
+    with METRICS.stage("candidates"):
+        cands = candidate_outfits(pools, limit, np.random.default_rng(seed))
+    with METRICS.stage("score"):
+        scores = score_outfits(matrix, cands)
+    METRICS.add("outfits_scored", len(cands))
+    # Hard rules (colour blacklist, denim, style) are checked lazily on the
+    # best-scored candidates only, walking down until k valid outfits are found
+    order = np.argsort(-scores, kind="stable")
+    out: list[tuple[float, list[int]]] = []
+    seen = set()
+    with METRICS.stage("validate"):
+        for idx in order:
+            row = [int(x) for x in cands[idx]]
+            key = tuple(row)
+            if key in seen:
+                continue
+            seen.add(key)
+            chosen: list[int] = []
+            chosen_slots: list[str] = []
+            ok = True
+            for slot, item in zip(slots, row):
+                if item < 0:
+                    continue
+                if not wardrobe.compatible(chosen, item, slot, chosen_slots):
+                    ok = False
+                    break
+                chosen.append(item)
+                chosen_slots.append(slot)
+            if ok:
+                out.append((float(scores[idx]), row))
+                if len(out) >= k:
+                    break
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rank outfit candidates by colour harmony")
+    ap.add_argument("--manifest", required=True, help="Path to manifest.json or a .snap snapshot")
+    ap.add_argument("--public", default=None, help="Public directory: sample image colours for items without colorHints")
+    ap.add_argument("--top-k", type=int, default=10, help="Number of outfits to return")
+    ap.add_argument("--limit", type=int, default=200_000, help="Max candidates scored (random sample beyond this)")
+    ap.add_argument("--jacket", action="store_true", help="Include outerwear in every outfit")
+    ap.add_argument("--seed", type=int, default=0, help="Seed for candidate sampling")
+    add_metrics_args(ap)
+    args = ap.parse_args()
+    configure_metrics(args)
+
+    with METRICS.stage("read_manifest"):
+        wardrobe = Wardrobe(load_records(Path(args.manifest).expanduser()))
+    public_dir = Path(args.public).expanduser().resolve() if args.public else None
+    with METRICS.stage("colors"):
+        lab = item_colors(wardrobe.items, public_dir)
+    with METRICS.stage("matrix"):
+        matrix = harmony_matrix(lab)
+
+    slots = SLOTS if args.jacket else SLOTS[:-1]
+    for score, row in top_k_outfits(wardrobe, matrix, slots, args.top_k, args.limit, args.seed):
+        outfit = {slot: (wardrobe.ids[i] if i >= 0 else None) for slot, i in zip(slots, row)}
+        names = [wardrobe.items[i].get("name") for i in row if i >= 0]
+        print(json.dumps({"score": round(score, 4), **outfit, "names": names}, ensure_ascii=False))
+    METRICS.finish(args.metrics_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+except Exception:
+    resource = None
+
+
+COUNTERS = ("bytes_read", "bytes_written", "image_decodes")
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def peak_rss_kb() -> int | None:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    if sys.platform == "darwin":
+        rss //= 1024
+    return int(rss)
+
+
+def cpu_seconds() -> float:
+    # Include reaped children so pdflatex & co. are accounted for
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class Metrics:
+    """Per-stage wall/CPU time, I/O and decode counters for the tools scripts.
+
+    Memory is reported as the process peak RSS in ``total`` and, per stage,
+    as the growth of that peak while the stage ran.
+
+    Disabled instances hand out a shared null context from ``stage()`` and
+    ignore ``add()``, so leaving the calls in hot loops is essentially free.
+    """
+
+    def __init__(self, enabled: bool = False, profile_stage: str | None = None):
+        self.enabled = enabled
+        self.profile_stage = profile_stage
+        self.stages: dict[str, dict] = {}
+        self.counters: dict[str, int] = {}
+        self._stack: list[str] = []
+        self._profiler: cProfile.Profile | None = None
+        self._started = time.perf_counter()
+        self._cpu_started = cpu_seconds()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name: str):
+        st = self.stages.get(name)
+        if st is None:
+            st = {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_rss_growth_kb": 0}
+            st.update({c: 0 for c in COUNTERS})
+            self.stages[name] = st
+        profiling = name == self.profile_stage and self._profiler_idle()
+        self._stack.append(name)
+        w0 = time.perf_counter()
+        c0 = cpu_seconds()
+        r0 = peak_rss_kb()
+        if profiling:
+            self._profiler.enable()
+        try:
+            yield
+        finally:
+            if profiling:
+                self._profiler.disable()
+            st["calls"] += 1
+            st["wall_s"] += time.perf_counter() - w0
+            st["cpu_s"] += cpu_seconds() - c0
+            # ru_maxrss is a process-wide high-water mark, so a stage can only be
+            # charged with how far it pushed that mark, not with its own peak
+            r1 = peak_rss_kb()
+            if r0 is not None and r1 is not None:
+                st["peak_rss_growth_kb"] += r1 - r0
+            self._stack.pop()
+
+    def _profiler_idle(self) -> bool:
+        # Nested entries of the profiled stage are covered by the outer one
+        if self.profile_stage in self._stack:
+            return False
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+        return True
+
+    def add(self, counter: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        self.counters[counter] = self.counters.get(counter, 0) + n
+        if self._stack:
+            st = self.stages[self._stack[-1]]
+            st[counter] = st.get(counter, 0) + n
+
+    def add_file_read(self, path: Path) -> None:
+        if self.enabled:
+            self.add("bytes_read", os.path.getsize(path))
+
+    def add_file_written(self, path: Path) -> None:
+        if self.enabled:
+            self.add("bytes_written", os.path.getsize(path))
+
+    def report(self) -> dict:
+        return {
+            "argv": sys.argv,
+            "total": {
+                "wall_s": round(time.perf_counter() - self._started, 6),
+                "cpu_s": round(cpu_seconds() - self._cpu_started, 6),
+                "peak_rss_kb": peak_rss_kb(),
+                **{c: self.counters.get(c, 0) for c in COUNTERS},
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "stages": {
+                name: {k: round(v, 6) if isinstance(v, float) else v for k, v in st.items()}
+                for name, st in self.stages.items()
+            },
+        }
+
+    def profile_text(self, limit: int = 25) -> str:
+        if self._profiler is None:
+            return ""
+        buf = io.StringIO()
+        pstats.Stats(self._profiler, stream=buf).sort_stats("cumulative").print_stats(limit)
+        return buf.getvalue()
+
+    def finish(self, metrics_out: str | None = None) -> None:
+        if not self.enabled:
+            return
+        report = self.report()
+        if metrics_out:
+            out = Path(metrics_out).expanduser().resolve()
+            out.parent.mkdir(parents=True, exist_ok=True)
+            with open(out, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            if self._profiler is not None:
+                self._profiler.dump_stats(str(out.with_suffix(".prof")))
+            print(f"Wrote metrics -> {out}", file=sys.stderr)
+        else:
+            print(json.dumps(report, indent=2), file=sys.stderr)
+        if self._profiler is not None:
+            print(self.profile_text(), file=sys.stderr)
+
+
+METRICS = Metrics()
+
+
+def add_metrics_args(ap: argparse.ArgumentParser) -> None:
+    g = ap.add_argument_group("instrumentation")
+    g.add_argument("--profile", action="store_true", help="Record per-stage metrics and print a JSON report to stderr")
+    g.add_argument("--metrics-out", default=None, help="Write the per-stage JSON report to this path (implies --profile)")
+    g.add_argument("--profile-stage", default=None, help="Run cProfile on this stage only (implies --profile)")
+
+
+def configure_metrics(args: argparse.Namespace) -> Metrics:
+    METRICS.enabled = bool(args.profile or args.metrics_out or args.profile_stage)
+    METRICS.profile_stage = args.profile_stage
+    return METRICS
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+from pathlib import Path
+
+from metrics import METRICS
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+
+HASH_ALGOS = ("dhash", "phash")
+CACHE_VERSION = 1
+
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+# cos((2x + 1) * u * pi / 2N) for the 8 lowest DCT frequencies of a 32-sample row
+_DCT = [
+    [math.cos((2 * x + 1) * u * math.pi / (2 * _PHASH_SIZE)) for x in range(_PHASH_SIZE)]
+    for u in range(_PHASH_LOW)
+]
+
+
+def load_gray(image_path: Path, size: tuple[int, int]) -> list[int]:
+    im = Image.open(image_path)
+    METRICS.add("image_decodes")
+    METRICS.add_file_read(image_path)
+    # Large photos decode much faster at reduced scale (JPEG draft mode)
+    im.draft("L", (size[0] * 4, size[1] * 4))
+    if im.mode in ("RGBA", "LA", "P"):
+        # Cut-outs: flatten onto white so transparent pixels hash consistently
+        im = im.convert("RGBA")
+        bg = Image.new("RGBA", im.size, (255, 255, 255, 255))
+        im = Image.alpha_composite(bg, im)
+    im = im.convert("L").resize(size, Image.LANCZOS)
+    return list(im.getdata())
+
+
+def dhash(image_path: Path) -> int:
+    px = load_gray(image_path, (9, 8))
+    h = 0
+    for y in range(8):
+        row = px[y * 9:(y + 1) * 9]
+        for x in range(8):
+            h = (h << 1) | (1 if row[x] < row[x + 1] else 0)
+    return h
+
+
+def phash(image_path: Path) -> int:
+    n = _PHASH_SIZE
+    px = load_gray(image_path, (n, n))
+    # Separable 2D DCT-II restricted to the 8x8 low-frequency block
+    rows = [
+        [sum(c * v for c, v in zip(_DCT[u], px[y * n:(y + 1) * n])) for u in range(_PHASH_LOW)]
+        for y in range(n)
+    ]
+    coeffs = [
+        sum(_DCT[v][y] * rows[y][u] for y in range(n))
+        for v in range(_PHASH_LOW)
+        for u in range(_PHASH_LOW)
+    ]
+    # Median of the AC terms; the DC term would skew it towards overall brightness
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    h = 0
+    for c in coeffs:
+        h = (h << 1) | (1 if c > median else 0)
+    return h
+
+
+HASH_FUNCS = {"dhash": dhash, "phash": phash}
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with hamming distance."""
+
+    def __init__(self):
+        self.root: list | None = None  # [hash, key, {distance: child}]
+        self.size = 0
+
+    def add(self, h: int, key) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [h, key, {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, key, {}]
+                return
+            node = child
+
+    def query(self, h: int, radius: int) -> list[tuple[int, object]]:
+        found: list[tuple[int, object]] = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.append((d, node[1]))
+            lo, hi = d - radius, d + radius
+            for cd, child in node[2].items():
+                if lo <= cd <= hi:
+                    stack.append(child)
+        return found
+
+
+def load_hash_cache(cache_path: Path | None, algo: str) -> dict[str, list]:
+    if cache_path is None or not cache_path.exists():
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION or data.get("algo") != algo:
+        return {}
+    return data.get("entries", {})
+
+
+def save_hash_cache(cache_path: Path, algo: str, entries: dict[str, list]) -> None:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name(cache_path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "algo": algo, "entries": entries}, f, separators=(",", ":"), sort_keys=True)
+    os.replace(tmp, cache_path)
+
+
+def hash_files(paths: dict[str, Path], algo: str = "dhash", cache_path: Path | None = None) -> dict[str, int]:
+    """Hash every file in ``paths`` (key -> path), reusing cached hashes whose
+    mtime and size still match. The cache is rewritten with only the keys seen.
+    """
+    if Image is None:
+        raise SystemExit("Pillow (PIL) is required for duplicate detection. Install with: pip install pillow")
+    func = HASH_FUNCS[algo]
+    cache = load_hash_cache(cache_path, algo)
+    entries: dict[str, list] = {}
+    hashes: dict[str, int] = {}
+    for key, path in paths.items():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            # Deleted since it was listed; the caller sees it missing from the result
+            continue
+        cached = cache.get(key)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            h = int(cached[2], 16)
+            METRICS.add("hash_cache_hits")
+        else:
+            try:
+                h = func(path)
+            except Exception as e:
+                print(f"Skipping hash for {key}: {e}")
+                continue
+            METRICS.add("hash_cache_misses")
+        hashes[key] = h
+        entries[key] = [st.st_mtime_ns, st.st_size, f"{h:016x}"]
+    if cache_path is not None:
+        save_hash_cache(cache_path, algo, entries)
+    return hashes
+
+
+def group_near_duplicates(hashes: dict[str, int], threshold: int, rank=None) -> list[list[str]]:
+    """Cluster keys whose hashes are within ``threshold`` bits of a leader.
+
+    Keys are visited in ``rank`` order (best first; defaults to key order) and
+    each one not yet grouped leads a new group of the ungrouped keys its
+    BK-tree query returns. Every member is thus a near-duplicate of the
+    group's first key; chains A~B~C with A far from C are not merged.
+    Singletons are omitted.
+    """
+    tree = BKTree()
+    for key in sorted(hashes):
+        tree.add(hashes[key], key)
+
+    rank = rank or (lambda k: k)
+    grouped: set[str] = set()
+    out = []
+    for leader in sorted(hashes, key=rank):
+        if leader in grouped:
+            continue
+        grouped.add(leader)
+        members = [k for _, k in tree.query(hashes[leader], threshold) if k not in grouped]
+        grouped.update(members)
+        if members:
+            out.append([leader, *sorted(members, key=rank)])
+    out.sort(key=lambda g: g[0])
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="List near-duplicate images under a folder")
+    ap.add_argument("--source", required=True, help="Folder with images")
+    ap.add_argument("--algo", choices=HASH_ALGOS, default="dhash", help="Perceptual hash to use")
+    ap.add_argument("--threshold", type=int, default=6, help="Max hamming distance (of 64 bits) for a duplicate")
+    ap.add_argument("--cache", default=None, help="Optional hash cache file")
+    args = ap.parse_args()
+
+    src_root = Path(args.source).expanduser().resolve()
+    exts = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+    paths = {
+        p.relative_to(src_root).as_posix(): p
+        for p in sorted(src_root.rglob("*"))
+        if p.is_file() and p.suffix.lower() in exts
+    }
+    cache = Path(args.cache).expanduser().resolve() if args.cache else None
+    hashes = hash_files(paths, args.algo, cache)
+    groups = group_near_duplicates(hashes, args.threshold)
+    for g in groups:
+        print(" ~ ".join(g))
+    print(f"{len(groups)} duplicate groups among {len(hashes)} images")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+import argparse
+import datetime as dt
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+from build_manifest import stable_id
+from metrics import METRICS, add_metrics_args, configure_metrics
+from snapshot import load_records
+
+
+# Same slots (and order) as generateOutfit in docs/main.js
+SLOTS = ("top_base", "top_overshirt", "bottom", "shoes", "outerwear")
+
+LOUD_COLORS = {"red", "yellow", "purple", "orange"}
+DENIM_SLOTS = {"top_base", "top_overshirt", "bottom"}
+
+EMPTY = 0xFFFFFFFF
+STATE_MAGIC = b"ROT1"
+STATE_HEADER = struct.Struct("<4sHHHI")  # magic, n_days, m_days, n_slots, n_items
+MAX_WINDOW = 0xFFFF  # n_days / m_days are stored as u16
+USER_HEADER = struct.Struct("<Hi")  # user id length, last planned day (ordinal)
+
+
+def slot_for(item: dict) -> str | None:
+    cat = item.get("category")
+    if cat == "top":
+        return "top_overshirt" if item.get("topLayer") == "overshirt" else "top_base"
+    if cat in ("bottom", "pants"):
+        return "bottom"
+    if cat in ("outerwear", "jacket"):
+        return "outerwear"
+    if cat == "shoes":
+        return "shoes"
+    return None
+
+
+def item_id(item: dict) -> str:
+    # items_to_upload.json entries carry no id; derive one the way build_manifest does
+    return item.get("id") or stable_id(item["file"])
+
+
+def id_key(iid: str) -> bytes:
+    # 8 bytes per item in the state file: manifest ids are already 16 hex chars
+    if len(iid) == 16:
+        try:
+            return bytes.fromhex(iid)
+        except ValueError:
+            pass
+    return hashlib.blake2b(iid.encode("utf-8"), digest_size=8).digest()
+
+
+class Wardrobe:
+    """Manifest items flattened into per-slot index pools for the scheduler."""
+
+    def __init__(self, items: list[dict]):
+        self.items: list[dict] = []
+        self.ids: list[str] = []
+        self.colors: list[frozenset] = []
+        self.styles: list[frozenset] = []
+        self.pools: dict[str, list[int]] = {s: [] for s in SLOTS}
+        for it in items:
+            slot = slot_for(it)
+            if slot is None:
+                continue
+            self.pools[slot].append(len(self.ids))
+            self.items.append(it)
+            self.ids.append(item_id(it))
+            self.colors.append(frozenset(it.get("colorHints") or []))
+            self.styles.append(frozenset(it.get("styleHints") or []))
+        self.index = {id_key(iid): i for i, iid in enumerate(self.ids)}
+
+    def compatible(self, chosen: list[int], cand: int, cand_slot: str, slots: list[str]) -> bool:
+        # Python port of validCombo: colour blacklist, one loud colour, no
+        # denim-on-denim between tops and bottom, no formal + sport/street pair
+        palette = set(self.colors[cand])
+        for i in chosen:
+            palette |= self.colors[i]
+        if "black" in palette and ("navy" in palette or "blue" in palette):
+            return False
+        if len(palette & LOUD_COLORS) > 1:
+            return False
+        cand_denim = "denim" in self.colors[cand] and cand_slot in DENIM_SLOTS
+        for i, slot in zip(chosen, slots):
+            if cand_denim and slot in DENIM_SLOTS and "denim" in self.colors[i]:
+                if (slot == "bottom") != (cand_slot == "bottom"):
+                    return False
+            # Shoes are universally usable: no style conflicts against shoes
+            if slot == "shoes" or cand_slot == "shoes":
+                continue
+            styles = self.styles[cand] | self.styles[i]
+            if "formal" in styles and ("sport" in styles or "street" in styles):
+                return False
+        return True
+
+    def signature(self, chosen: list[int]) -> int:
+        raw = ",".join(self.ids[i] for i in chosen).encode("utf-8")
+        return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little") or 1
+
+
+class UserRotation:
+    """Wear history of one user as fixed-size ring buffers indexed by day.
+
+    ``rings[s][day % n_days]`` is the item worn in slot ``s`` on ``day`` and
+    ``recent[s]`` counts items currently inside that window, so "worn in the
+    last N days" is one dict lookup. Outfit signatures work the same way over
+    ``m_days``.
+    """
+
+    __slots__ = ("n_days", "m_days", "last_day", "rings", "recent", "outfits", "recent_outfits")
+
+    def __init__(self, n_slots: int, n_days: int, m_days: int, last_day: int = -1):
+        self.n_days = n_days
+        self.m_days = m_days
+        self.last_day = last_day
+        self.rings = [array("I", [EMPTY]) * n_days for _ in range(n_slots)]
+        self.recent: list[dict[int, int]] = [{} for _ in range(n_slots)]
+        self.outfits = array("Q", [0]) * m_days
+        self.recent_outfits: dict[int, int] = {}
+
+    def _put(self, ring: array, counts: dict, pos: int, value: int, empty: int) -> None:
+        old = ring[pos]
+        if old != empty:
+            n = counts[old] - 1
+            if n:
+                counts[old] = n
+            else:
+                del counts[old]
+        ring[pos] = value
+        if value != empty:
+            counts[value] = counts.get(value, 0) + 1
+
+    def advance(self, day: int) -> None:
+        # Forget skipped days so their slots don't linger in the windows
+        if self.last_day >= 0:
+            for d in range(self.last_day + 1, self.last_day + 1 + min(day - self.last_day - 1, self.n_days)):
+                for ring, counts in zip(self.rings, self.recent):
+                    self._put(ring, counts, d % self.n_days, EMPTY, EMPTY)
+            for d in range(self.last_day + 1, self.last_day + 1 + min(day - self.last_day - 1, self.m_days)):
+                self._put(self.outfits, self.recent_outfits, d % self.m_days, 0, 0)
+
+    def worn_recently(self, slot: int, item: int) -> bool:
+        return item in self.recent[slot]
+
+    def repeats_outfit(self, sig: int) -> bool:
+        return sig in self.recent_outfits
+
+    def record(self, day: int, picks: list[int], sig: int) -> None:
+        self.advance(day)
+        pos = day % self.n_days
+        for ring, counts, item in zip(self.rings, self.recent, picks):
+            self._put(ring, counts, pos, item, EMPTY)
+        self._put(self.outfits, self.recent_outfits, day % self.m_days, sig, 0)
+        self.last_day = day
+
+    def oldest_worn(self, slot: int, candidates: list[int]) -> int:
+        # Fallback when every candidate is inside the window: least recently worn
+        ring = self.rings[slot]
+        age = {}
+        for back in range(self.n_days):
+            item = ring[(self.last_day - back) % self.n_days]
+            if item != EMPTY and item not in age:
+                age[item] = back
+        return max(candidates, key=lambda i: age.get(i, self.n_days))
+
+
+def load_state(path: Path, wardrobe: Wardrobe, n_days: int, m_days: int) -> dict[str, UserRotation]:
+    users: dict[str, UserRotation] = {}
+    if not path.exists():
+        return users
+    with open(path, "rb") as f:
+        data = f.read()
+    METRICS.add("bytes_read", len(data))
+    magic, f_n, f_m, f_slots, f_items = STATE_HEADER.unpack_from(data, 0)
+    if magic != STATE_MAGIC or f_slots != len(SLOTS):
+        raise SystemExit(f"Not a rotation state file: {path}")
+    off = STATE_HEADER.size
+    # Item table: 8-byte manifest ids, remapped onto the current manifest
+    remap = array("I", [EMPTY]) * f_items
+    for k in range(f_items):
+        remap[k] = wardrobe.index.get(data[off:off + 8], EMPTY)
+        off += 8
+    (n_users,) = struct.unpack_from("<I", data, off)
+    off += 4
+    for _ in range(n_users):
+        ulen, last_day = USER_HEADER.unpack_from(data, off)
+        off += USER_HEADER.size
+        user = data[off:off + ulen].decode("utf-8")
+        off += ulen
+        rings = []
+        for _ in range(f_slots):
+            ring = array("I")
+            ring.frombytes(data[off:off + 4 * f_n])
+            off += 4 * f_n
+            rings.append(ring)
+        outfits = array("Q")
+        outfits.frombytes(data[off:off + 8 * f_m])
+        off += 8 * f_m
+        if sys.byteorder != "little":
+            for ring in rings:
+                ring.byteswap()
+            outfits.byteswap()
+        # Replay the stored window into rings of the requested size
+        state = UserRotation(len(SLOTS), n_days, m_days, last_day)
+        for back in range(min(f_n, n_days)):
+            day = last_day - back
+            for s, ring in enumerate(rings):
+                item = ring[day % f_n]
+                item = remap[item] if item != EMPTY else EMPTY
+                state._put(state.rings[s], state.recent[s], day % n_days, item, EMPTY)
+        for back in range(min(f_m, m_days)):
+            day = last_day - back
+            state._put(state.outfits, state.recent_outfits, day % m_days, outfits[day % f_m], 0)
+        users[user] = state
+    return users
+
+
+def save_state(path: Path, wardrobe: Wardrobe, users: dict[str, UserRotation], n_days: int, m_days: int) -> None:
+    parts = [STATE_HEADER.pack(STATE_MAGIC, n_days, m_days, len(SLOTS), len(wardrobe.ids))]
+    parts.extend(id_key(iid) for iid in wardrobe.ids)
+    parts.append(struct.pack("<I", len(users)))
+    for user, state in users.items():
+        raw = user.encode("utf-8")
+        parts.append(USER_HEADER.pack(len(raw), state.last_day))
+        parts.append(raw)
+        for ring in state.rings:
+            if sys.byteorder != "little":
+                ring = array("I", ring)
+                ring.byteswap()
+            parts.append(ring.tobytes())
+        outfits = state.outfits
+        if sys.byteorder != "little":
+            outfits = array("Q", outfits)
+            outfits.byteswap()
+        parts.append(outfits.tobytes())
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        for p in parts:
+            f.write(p)
+    os.replace(tmp, path)
+    METRICS.add_file_written(path)
+
+
+def plan_day(
+    wardrobe: Wardrobe,
+    state: UserRotation,
+    day: int,
+    rng: random.Random,
+    slots: tuple[str, ...],
+    attempts: int = 8,
+) -> list[int]:
+    state.advance(day)
+    picks: list[int] = []
+    sig = 0
+    for _ in range(attempts):
+        picks = []
+        chosen_slots: list[str] = []
+        for slot in slots:
+            s = SLOTS.index(slot)
+            pool = wardrobe.pools[slot]
+            if not pool:
+                picks.append(EMPTY)
+                chosen_slots.append(slot)
+                continue
+            chosen = [i for i in picks if i != EMPTY]
+            chosen_in = [sl for sl, i in zip(chosen_slots, picks) if i != EMPTY]
+            # Window check first: it is a dict lookup, compatibility is not
+            fresh = [i for i in pool if not state.worn_recently(s, i) and wardrobe.compatible(chosen, i, slot, chosen_in)]
+            if fresh:
+                pick = rng.choice(fresh)
+            else:
+                METRICS.add("rotation_window_relaxed")
+                ok = [i for i in pool if wardrobe.compatible(chosen, i, slot, chosen_in)]
+                pick = state.oldest_worn(s, ok or pool)
+            picks.append(pick)
+            chosen_slots.append(slot)
+        sig = wardrobe.signature([i for i in picks if i != EMPTY])
+        if not state.repeats_outfit(sig):
+            break
+        METRICS.add("rotation_outfit_retries")
+    # Rings are indexed by SLOTS; slots not planned (e.g. no jacket) stay empty
+    full = [EMPTY] * len(SLOTS)
+    for slot, item in zip(slots, picks):
+        full[SLOTS.index(slot)] = item
+    state.record(day, full, sig)
+    return full
+
+
+def read_users(args: argparse.Namespace) -> list[str]:
+    users = list(args.user or [])
+    if args.users:
+        with open(Path(args.users).expanduser(), "r", encoding="utf-8") as f:
+            users.extend(line.strip() for line in f if line.strip())
+    return users
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Plan no-repeat outfit rotations for many users")
+    ap.add_argument("--manifest", required=True, help="Path to manifest.json, items_to_upload.json or a .snap snapshot")
+    ap.add_argument("--state", required=True, help="Rotation state file (created if missing)")
+    ap.add_argument("--user", action="append", help="User id to plan for (repeatable)")
+    ap.add_argument("--users", default=None, help="File with one user id per line")
+    ap.add_argument("--start", default=None, help="First day to plan, YYYY-MM-DD (default: today)")
+    ap.add_argument("--days", type=int, default=30, help="Number of days to plan")
+    ap.add_argument("--item-window", type=int, default=7, help="Do not repeat an item within this many days")
+    ap.add_argument("--outfit-window", type=int, default=90, help="Do not repeat a whole outfit within this many days")
+    ap.add_argument("--jacket", action="store_true", help="Include outerwear in every outfit")
+    ap.add_argument("--seed", type=int, default=0, help="Seed for deterministic plans")
+    ap.add_argument("--out", default=None, help="Write the plan as JSON lines here (default: stdout)")
+    add_metrics_args(ap)
+    args = ap.parse_args()
+    configure_metrics(args)
+
+    users = read_users(args)
+    if not users:
+        raise SystemExit("No users given (use --user or --users)")
+    if not (1 <= args.item_window <= MAX_WINDOW and 1 <= args.outfit_window <= MAX_WINDOW):
+        raise SystemExit(f"--item-window and --outfit-window must be between 1 and {MAX_WINDOW}")
+
+    with METRICS.stage("read_manifest"):
+        wardrobe = Wardrobe(load_records(Path(args.manifest).expanduser()))
+    state_path = Path(args.state).expanduser().resolve()
+    with METRICS.stage("load_state"):
+        states = load_state(state_path, wardrobe, args.item_window, args.outfit_window)
+
+    start = dt.date.fromisoformat(args.start) if args.start else dt.date.today()
+    first = start.toordinal()
+    slots = SLOTS if args.jacket else SLOTS[:-1]
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    planned = skipped = 0
+    try:
+        with METRICS.stage("plan"):
+            for user in users:
+                state = states.get(user)
+                if state is None:
+                    state = states[user] = UserRotation(len(SLOTS), args.item_window, args.outfit_window)
+                for day in range(first, first + args.days):
+                    if day <= state.last_day:
+                        skipped += 1  # already planned in an earlier run
+                        continue
+                    rng = random.Random(f"{args.seed}:{user}:{day}")
+                    full = plan_day(wardrobe, state, day, rng, slots)
+                    row = {"user": user, "date": dt.date.fromordinal(day).isoformat()}
+                    for slot, item in zip(SLOTS, full):
+                        if slot in slots:
+                            row[slot] = wardrobe.ids[item] if item != EMPTY else None
+                    out.write(json.dumps(row) + "\n")
+                    planned += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    with METRICS.stage("save_state"):
+        save_state(state_path, wardrobe, states, args.item_window, args.outfit_window)
+    print(f"Planned {planned} outfit-days for {len(users)} users ({skipped} already planned) -> {state_path}", file=sys.stderr)
+    METRICS.finish(args.metrics_out)
+
+
+if __name__ == "__main__":
+    main()
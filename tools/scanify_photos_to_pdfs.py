@@ -5,14 +5,21 @@ import sys
 import time
 from pathlib import Path
 
+from metrics import METRICS, add_metrics_args, configure_metrics
+
 try:
-    from PIL import Image, ImageOps, ImageFilter, ImageEnhance
+    from PIL import Image, ImageOps, ImageFilter, ImageEnhance, ImageChops, features
 except Exception as e:  # pragma: no cover
     sys.stderr.write(
         "Pillow (PIL) is required. Install with: pip install pillow\n"
     )
     raise
 
+try:
+    import numpy as np
+except Exception:
+    np = None
+
 
 def list_images(input_dir: Path) -> list[Path]:
     valid_exts = {".jpg", ".jpeg", ".png", ".heic"}
@@ -31,6 +38,8 @@ def looks_like_carta_id(filename: str) -> bool:
 
 def open_and_fix_orientation(image_path: Path) -> Image.Image:
     img = Image.open(image_path)
+    METRICS.add("image_decodes")
+    METRICS.add_file_read(image_path)
     # Respect EXIF rotation if present
     try:
         img = ImageOps.exif_transpose(img)
@@ -65,22 +74,78 @@ def scanify_color(img: Image.Image) -> Image.Image:
     return rgb
 
 
+def sauvola(gray: Image.Image, window: int = 31, k: float = 0.2, r: float = 128.0, strip: int = 256) -> Image.Image:
+    # T = mean * (1 + k * (std / r - 1)) over a window x window neighbourhood.
+    # Local sums come from integral images built one horizontal strip at a time,
+    # so memory stays at a few strip-sized float arrays even for 12MP photos.
+    window |= 1
+    half = window // 2
+    a = np.asarray(gray.convert("L"))
+    h, w = a.shape
+    padded = np.pad(a, half, mode="reflect")
+    out = np.empty((h, w), dtype=bool)
+    area = float(window * window)
+
+    def box(ii):
+        return ii[window:, window:] - ii[:-window, window:] - ii[window:, :-window] + ii[:-window, :-window]
+
+    for y0 in range(0, h, strip):
+        y1 = min(h, y0 + strip)
+        blk = padded[y0:y1 + 2 * half].astype(np.float64)
+        ii = np.zeros((blk.shape[0] + 1, blk.shape[1] + 1))
+        ii2 = np.zeros_like(ii)
+        np.cumsum(np.cumsum(blk, axis=0), axis=1, out=ii[1:, 1:])
+        np.cumsum(np.cumsum(blk * blk, axis=0), axis=1, out=ii2[1:, 1:])
+        mean = box(ii) / area
+        std = np.sqrt(np.maximum(box(ii2) / area - mean * mean, 0.0))
+        thresh = mean * (1.0 + k * (std / r - 1.0))
+        out[y0:y1] = a[y0:y1] > thresh
+    return Image.fromarray(out)
+
+
+def bradley(gray: Image.Image, window: int = 31, t: float = 0.15) -> Image.Image:
+    # Pillow-only fallback: black where the pixel is t below its local mean
+    gray = gray.convert("L")
+    limit = gray.filter(ImageFilter.BoxBlur(window // 2)).point(lambda v: int(v * (1.0 - t)))
+    below = ImageChops.subtract(limit, gray)
+    return below.point(lambda v: 0 if v else 255).convert("1", dither=Image.Dither.NONE)
+
+
+def binarize(gray: Image.Image, window: int = 31) -> Image.Image:
+    if np is not None:
+        return sauvola(gray, window=window)
+    return bradley(gray, window=window)
+
+
 def to_pdf_pages(images: list[Image.Image]) -> list[Image.Image]:
     pages: list[Image.Image] = []
     for im in images:
-        if im.mode != "RGB":
+        # Bilevel pages stay "1" (CCITT G4), lossless colour pages stay "RGBA" (JPEG 2000)
+        if im.mode not in ("RGB", "1", "RGBA"):
             pages.append(im.convert("RGB"))
         else:
             pages.append(im)
     return pages
 
 
-def save_pdf(pages: list[Image.Image], output_path: Path) -> None:
+def is_jpeg_page(im: Image.Image) -> bool:
+    if im.mode == "1":
+        return not features.check("libtiff")
+    return im.mode in ("RGB", "L", "CMYK")
+
+
+def save_pdf(pages: list[Image.Image], output_path: Path, jpeg_quality: int | None = None) -> None:
     if not pages:
         return
     output_path.parent.mkdir(parents=True, exist_ok=True)
     first, rest = pages[0], pages[1:]
-    first.save(output_path, "PDF", resolution=300.0, save_all=True, append_images=rest)
+    # Pillow picks the filter per page mode: "1" -> CCITT G4, "RGBA" -> JPEG 2000, else JPEG.
+    # The save options reach every page's encoder, and the G4 one rejects "quality"
+    opts = {}
+    if jpeg_quality is not None and all(is_jpeg_page(p) for p in pages):
+        opts["quality"] = jpeg_quality
+    first.save(output_path, "PDF", resolution=300.0, save_all=True, append_images=rest, **opts)
+    METRICS.add_file_written(output_path)
 
 
 def main() -> None:
@@ -89,15 +154,35 @@ def main() -> None:
     ap.add_argument("--outdir", required=True, help="Output directory for PDFs")
     ap.add_argument("--carta_prefix", default="carta-id", help="Filename prefix for Carta-ID PDF")
     ap.add_argument("--docs_prefix", default="docs", help="Filename prefix for other docs PDF")
+    ap.add_argument("--bilevel", action="store_true", help="Threshold doc pages to black/white and embed them with CCITT G4")
+    ap.add_argument("--bilevel-window", type=int, default=31, help="Local threshold window in pixels (--bilevel)")
+    ap.add_argument("--jpeg-quality", type=int, default=None, help="JPEG quality 1-95 for colour / grayscale pages (not applied to G4 pages)")
+    ap.add_argument(
+        "--color-mode",
+        choices=["jpeg", "lossless"],
+        default="jpeg",
+        help="Carta-ID pages: JPEG (see --jpeg-quality) or lossless JPEG 2000",
+    )
+    add_metrics_args(ap)
     args = ap.parse_args()
+    configure_metrics(args)
+
+    if args.bilevel and not features.check("libtiff"):
+        print("Pillow was built without libtiff: bilevel pages will be stored as JPEG, not CCITT G4")
+    if args.bilevel and np is None:
+        print("NumPy not installed: using Bradley thresholding instead of Sauvola")
+    if args.color_mode == "lossless" and not features.check("jpg_2000"):
+        raise SystemExit("Pillow was built without OpenJPEG: --color-mode lossless is unavailable")
 
     input_dir = Path(args.input).expanduser().resolve()
     output_dir = Path(args.outdir).expanduser().resolve()
     ts = time.strftime("%Y%m%d-%H%M%S")
 
-    all_images = list_images(input_dir)
+    with METRICS.stage("list"):
+        all_images = list_images(input_dir)
     if not all_images:
         print(f"No images found in {input_dir}")
+        METRICS.finish(args.metrics_out)
         return
 
     carta_imgs: list[Image.Image] = []
@@ -105,11 +190,15 @@ def main() -> None:
 
     for p in all_images:
         try:
-            img = open_and_fix_orientation(p)
-            if looks_like_carta_id(p.name):
-                carta_imgs.append(scanify_color(img))
-            else:
-                docs_imgs.append(scanify(img))
+            with METRICS.stage("decode"):
+                img = open_and_fix_orientation(p)
+            with METRICS.stage("scanify"):
+                if looks_like_carta_id(p.name):
+                    page = scanify_color(img)
+                    carta_imgs.append(page.convert("RGBA") if args.color_mode == "lossless" else page)
+                else:
+                    page = scanify(img)
+                    docs_imgs.append(binarize(page, args.bilevel_window) if args.bilevel else page)
         except Exception as e:
             print(f"Skipping {p.name}: {e}")
 
@@ -117,16 +206,19 @@ def main() -> None:
     docs_out = output_dir / f"{args.docs_prefix}-{ts}.pdf"
 
     if carta_imgs:
-        save_pdf(to_pdf_pages(carta_imgs), carta_out)
+        with METRICS.stage("save_pdf"):
+            save_pdf(to_pdf_pages(carta_imgs), carta_out, args.jpeg_quality)
         print(f"Wrote {carta_out}")
     else:
         print("No Carta-ID images detected.")
 
     if docs_imgs:
-        save_pdf(to_pdf_pages(docs_imgs), docs_out)
+        with METRICS.stage("save_pdf"):
+            save_pdf(to_pdf_pages(docs_imgs), docs_out, args.jpeg_quality)
         print(f"Wrote {docs_out}")
     else:
         print("No other documents detected.")
+    METRICS.finish(args.metrics_out)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import functools
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from metrics import METRICS, add_metrics_args, configure_metrics, peak_rss_kb
+
+
+# Layout (all little-endian):
+#   header   magic, version, n_records, n_strings, offsets/lengths of sections
+#   meta     small JSON: key shapes, colour table, style table
+#   strings  u32 offsets[n_strings + 1] followed by one UTF-8 blob, sorted
+#   records  n_records fixed-width RECORD structs, 8-byte aligned
+MAGIC = b"WSNP"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIQQQQQQ")  # magic, version, pad, n_records, n_strings, meta, strings, records (off, len)
+RECORD = struct.Struct("<7I4xQQ")  # shape, id, name, category, topLayer, file, extra, pad, colorMask, styleMask
+NONE = 0xFFFFFFFF
+
+COLUMNS = ("id", "name", "category", "topLayer", "file")
+HINT_COLUMNS = ("colorHints", "styleHints")
+MAX_HINTS = 64
+
+
+def _is_str_list(v) -> bool:
+    return isinstance(v, list) and all(isinstance(x, str) for x in v)
+
+
+def mask_of(values: list[str], table: dict[str, int]) -> int | None:
+    # Only canonical lists (table order, no duplicates) are stored as masks so
+    # the round trip reproduces them exactly; anything else goes to extras
+    bits = [table.get(v) for v in values]
+    if any(b is None for b in bits) or bits != sorted(set(bits)):
+        return None
+    m = 0
+    for b in bits:
+        m |= 1 << b
+    return m
+
+
+def hints_of(mask: int, names: list[str]) -> list[str]:
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(names[low.bit_length() - 1])
+        mask ^= low
+    return out
+
+
+def export_snapshot(records: list[dict], out_path: Path) -> None:
+    # Hint tables in sorted order, which is how build_manifest emits them
+    tables: dict[str, list[str]] = {}
+    for col in HINT_COLUMNS:
+        seen = sorted({h for r in records if _is_str_list(r.get(col)) for h in r[col]})
+        tables[col] = seen[:MAX_HINTS]
+    lookup = {col: {h: i for i, h in enumerate(names)} for col, names in tables.items()}
+
+    shapes: dict[tuple, int] = {}
+    strings: set[str] = set()
+    rows = []
+    for r in records:
+        shape = shapes.setdefault(tuple(r.keys()), len(shapes))
+        extra: dict = {}
+        cols: dict[str, str | None] = {}
+        for col in COLUMNS:
+            if col not in r:
+                continue
+            v = r[col]
+            if isinstance(v, str) or (col == "topLayer" and v is None):
+                cols[col] = v
+                if v is not None:
+                    strings.add(v)
+            else:
+                extra[col] = v
+        masks = {}
+        for col in HINT_COLUMNS:
+            if col not in r:
+                continue
+            m = mask_of(r[col], lookup[col]) if _is_str_list(r[col]) else None
+            if m is None:
+                extra[col] = r[col]
+            else:
+                masks[col] = m
+        for k, v in r.items():
+            if k not in COLUMNS and k not in HINT_COLUMNS:
+                extra[k] = v
+        extra_s = json.dumps(extra, ensure_ascii=False, separators=(",", ":")) if extra else None
+        if extra_s is not None:
+            strings.add(extra_s)
+        rows.append((shape, cols, masks, extra_s))
+
+    ordered = sorted(strings)
+    index = {s: i for i, s in enumerate(ordered)}
+    blob = bytearray()
+    offsets = [0]
+    for s in ordered:
+        blob += s.encode("utf-8")
+        offsets.append(len(blob))
+    strings_bytes = struct.pack(f"<{len(offsets)}I", *offsets) + bytes(blob)
+
+    meta = json.dumps(
+        {
+            "shapes": [list(k) for k in shapes],
+            "colorHints": tables["colorHints"],
+            "styleHints": tables["styleHints"],
+        },
+        ensure_ascii=False,
+    ).encode("utf-8")
+
+    def sidx(v: str | None) -> int:
+        return NONE if v is None else index[v]
+
+    rec_bytes = bytearray(RECORD.size * len(rows))
+    for i, (shape, cols, masks, extra_s) in enumerate(rows):
+        RECORD.pack_into(
+            rec_bytes,
+            i * RECORD.size,
+            shape,
+            *(sidx(cols.get(c)) for c in COLUMNS),
+            sidx(extra_s),
+            masks.get("colorHints", 0),
+            masks.get("styleHints", 0),
+        )
+
+    meta_off = HEADER.size
+    strings_off = meta_off + len(meta)
+    rec_off = (strings_off + len(strings_bytes) + 7) & ~7
+    header = HEADER.pack(
+        MAGIC, VERSION, 0, len(rows), len(ordered),
+        meta_off, len(meta), strings_off, len(strings_bytes), rec_off, len(rec_bytes),
+    )
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(meta)
+        f.write(strings_bytes)
+        f.write(b"\0" * (rec_off - strings_off - len(strings_bytes)))
+        f.write(rec_bytes)
+    os.replace(tmp, out_path)
+    METRICS.add_file_written(out_path)
+
+
+class Snapshot:
+    """Read-only, mmap-backed view of a wardrobe snapshot.
+
+    Opening only parses the header and the small meta block; records and
+    strings are decoded when accessed, so a query touches the fixed-width
+    record array and the handful of strings it returns.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self.n_records, self.n_strings,
+         meta_off, meta_len, str_off, _str_len, self._rec_off, _rec_len) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise SystemExit(f"Not a wardrobe snapshot: {path}")
+        meta = json.loads(self._mm[meta_off:meta_off + meta_len].decode("utf-8"))
+        self.shapes: list[list[str]] = meta["shapes"]
+        self.hint_names = {col: meta[col] for col in HINT_COLUMNS}
+        self._str_offsets = memoryview(self._mm)[str_off:str_off + 4 * (self.n_strings + 1)]
+        self._blob_off = str_off + 4 * (self.n_strings + 1)
+        self.string = functools.lru_cache(maxsize=4096)(self._string)
+
+    def close(self) -> None:
+        self._str_offsets.release()
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def _string(self, i: int) -> str | None:
+        if i == NONE:
+            return None
+        a, b = struct.unpack_from("<II", self._str_offsets, 4 * i)
+        return self._mm[self._blob_off + a:self._blob_off + b].decode("utf-8")
+
+    def string_index(self, s: str) -> int | None:
+        # Strings are stored sorted, so a bisect decodes only O(log n) of them
+        keys = _StringKeys(self)
+        i = bisect.bisect_left(keys, s)
+        return i if i < self.n_strings and self.string(i) == s else None
+
+    def raw(self, i: int) -> tuple:
+        return RECORD.unpack_from(self._mm, self._rec_off + i * RECORD.size)
+
+    def record(self, i: int) -> dict:
+        shape, *cols, extra_i, cmask, smask = self.raw(i)
+        extra = json.loads(self.string(extra_i)) if extra_i != NONE else {}
+        values = dict(zip(COLUMNS, cols))
+        masks = {"colorHints": cmask, "styleHints": smask}
+        out = {}
+        for key in self.shapes[shape]:
+            if key in extra:
+                out[key] = extra[key]
+            elif key in values:
+                out[key] = self.string(values[key])
+            else:
+                out[key] = hints_of(masks[key], self.hint_names[key])
+        return out
+
+    def records(self) -> list[dict]:
+        return [self.record(i) for i in range(self.n_records)]
+
+    def query(
+        self,
+        category: str | None = None,
+        top_layer: str | None = None,
+        color: str | None = None,
+        style: str | None = None,
+    ) -> list[int]:
+        """Indices of records matching every given filter.
+
+        Filters compare string indices and bitmasks on the raw structs; hints
+        kept in extras (non-canonical lists) are checked by decoding.
+        """
+        want_cat = self.string_index(category) if category is not None else None
+        want_layer = self.string_index(top_layer) if top_layer is not None else None
+        if (category is not None and want_cat is None) or (top_layer is not None and want_layer is None):
+            return []
+        cbit = self._bit("colorHints", color)
+        sbit = self._bit("styleHints", style)
+        view = memoryview(self._mm)[self._rec_off:self._rec_off + self.n_records * RECORD.size]
+        out = []
+        try:
+            for i, (_, _, _, cat, layer, _, extra_i, cmask, smask) in enumerate(RECORD.iter_unpack(view)):
+                if want_cat is not None and cat != want_cat:
+                    continue
+                if want_layer is not None and layer != want_layer:
+                    continue
+                if (color is not None and not (cmask & cbit)) or (style is not None and not (smask & sbit)):
+                    if extra_i == NONE or not self._extra_has(i, color, style):
+                        continue
+                out.append(i)
+        finally:
+            view.release()
+        return out
+
+    def _bit(self, col: str, value: str | None) -> int:
+        names = self.hint_names[col]
+        return 1 << names.index(value) if value in names else 0
+
+    def _extra_has(self, i: int, color: str | None, style: str | None) -> bool:
+        rec = self.record(i)
+        return (color is None or color in (rec.get("colorHints") or [])) and (
+            style is None or style in (rec.get("styleHints") or [])
+        )
+
+
+class _StringKeys:
+    # Sequence adaptor so bisect can probe the sorted string table lazily
+    def __init__(self, snap: Snapshot):
+        self.snap = snap
+
+    def __len__(self) -> int:
+        return self.snap.n_strings
+
+    def __getitem__(self, i: int) -> str:
+        return self.snap.string(i)
+
+
+def load_records(path: Path) -> list[dict]:
+    """Records from manifest.json or a .snap snapshot, whichever ``path`` is."""
+    with open(path, "rb") as f:
+        is_snap = f.read(4) == MAGIC
+    if is_snap:
+        with Snapshot(path) as snap:
+            return snap.records()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def rss_kb() -> int:
+    # Current (not peak) RSS: ru_maxrss survives fork/exec, so the bench child
+    # would start at the parent's high-water mark
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return peak_rss_kb() or 0
+
+
+def _measure(kind: str, path: str, category: str | None) -> None:
+    rss0 = rss_kb()
+    t0 = time.perf_counter()
+    if kind == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+        t_load = time.perf_counter() - t0
+        hits = [it for it in items if it.get("category") == category]
+    else:
+        snap = Snapshot(Path(path))
+        t_load = time.perf_counter() - t0
+        hits = [snap.record(i) for i in snap.query(category=category)]
+    t_total = time.perf_counter() - t0
+    print(json.dumps({"load_s": t_load, "query_s": t_total - t_load, "hits": len(hits), "rss_kb": rss_kb() - rss0}))
+
+
+def bench(manifest: Path, scale: int, category: str) -> None:
+    with open(manifest, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    records = []
+    for k in range(scale):
+        for r in base:
+            r = dict(r)
+            if "id" in r:
+                r["id"] = f"{k:06x}{r['id'][6:]}"
+            r["name"] = f"{r['name']}-{k}"
+            r["file"] = f"{r['file']}?v={k}"
+            records.append(r)
+    with tempfile.TemporaryDirectory() as tmp:
+        jpath = Path(tmp) / "manifest.json"
+        spath = Path(tmp) / "manifest.snap"
+        with open(jpath, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=2, ensure_ascii=False)
+        t0 = time.perf_counter()
+        export_snapshot(records, spath)
+        t_export = time.perf_counter() - t0
+        print(f"{len(records)} records: json {jpath.stat().st_size // 1024} KB, snapshot {spath.stat().st_size // 1024} KB (export {t_export:.2f}s)")
+        for kind, path in (("json", jpath), ("snap", spath)):
+            # Fresh interpreter per format so peak RSS is not shared
+            res = subprocess.run(
+                [sys.executable, __file__, "_measure", kind, str(path), category],
+                capture_output=True, text=True, check=True,
+            )
+            m = json.loads(res.stdout)
+            print(
+                f"  {kind:5s} load {m['load_s'] * 1000:8.1f} ms  query({category}) {m['query_s'] * 1000:8.1f} ms"
+                f"  hits {m['hits']}  +RSS {m['rss_kb'] / 1024:.1f} MB"
+            )
+
+
+def main():
+    if len(sys.argv) == 5 and sys.argv[1] == "_measure":
+        _measure(sys.argv[2], sys.argv[3], sys.argv[4])
+        return
+
+    ap = argparse.ArgumentParser(description="Compact binary wardrobe snapshots of manifest.json")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("export", help="manifest.json -> snapshot")
+    p.add_argument("--manifest", required=True, help="Path to manifest.json (or items_to_upload.json)")
+    p.add_argument("--out", required=True, help="Snapshot file to write")
+    p = sub.add_parser("import", help="snapshot -> manifest.json")
+    p.add_argument("--snapshot", required=True, help="Snapshot file")
+    p.add_argument("--out", required=True, help="manifest.json to write")
+    p = sub.add_parser("query", help="Print records matching the filters")
+    p.add_argument("--snapshot", required=True, help="Snapshot file")
+    p.add_argument("--category", default=None)
+    p.add_argument("--top-layer", default=None)
+    p.add_argument("--color", default=None)
+    p.add_argument("--style", default=None)
+    p = sub.add_parser("bench", help="Compare cold load time and RSS of JSON vs snapshot")
+    p.add_argument("--manifest", required=True, help="Seed manifest.json, replicated --scale times")
+    p.add_argument("--scale", type=int, default=1000, help="Copies of the seed records")
+    p.add_argument("--category", default="shoes", help="Category to query in the benchmark")
+    for p in sub.choices.values():
+        add_metrics_args(p)
+    args = ap.parse_args()
+    configure_metrics(args)
+
+    if args.cmd == "export":
+        with METRICS.stage("read_manifest"):
+            records = load_records(Path(args.manifest).expanduser())
+        with METRICS.stage("export"):
+            export_snapshot(records, Path(args.out).expanduser().resolve())
+        print(f"Wrote snapshot with {len(records)} items -> {args.out}")
+    elif args.cmd == "import":
+        with METRICS.stage("load"), Snapshot(Path(args.snapshot).expanduser()) as snap:
+            records = snap.records()
+        out = Path(args.out).expanduser().resolve()
+        with METRICS.stage("write_manifest"):
+            out.parent.mkdir(parents=True, exist_ok=True)
+            with open(out, "w", encoding="utf-8") as f:
+                json.dump(records, f, indent=2, ensure_ascii=False)
+        print(f"Wrote manifest with {len(records)} items -> {out}")
+    elif args.cmd == "query":
+        with METRICS.stage("query"), Snapshot(Path(args.snapshot).expanduser()) as snap:
+            for i in snap.query(args.category, args.top_layer, args.color, args.style):
+                print(json.dumps(snap.record(i), ensure_ascii=False))
+    else:
+        bench(Path(args.manifest).expanduser(), args.scale, args.category)
+    METRICS.finish(args.metrics_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+from pathlib import Path
+
+from metrics import METRICS, add_metrics_args, configure_metrics
+from rotation import item_id
+from snapshot import load_records
+
+try:
+    import fcntl
+except Exception:
+    fcntl = None
+
+
+# Layout under the store root:
+#   LOCK                              writer lock (readers never take it)
+#   store.json                        shard count and layout version
+#   shard-XX/segments.json            segment -> size, live bytes
+#   shard-XX/users/<hash>.json        one user's item id -> [segment, offset, length]
+#   shard-XX/<category>/NNNNNNNN.seg  append-only frames: u32 length, u32 crc32, JSON
+#
+# A query reads only its user's index file. Readers follow offsets in that
+# file, which the writer replaces atomically after its appends are fsynced
+# and segments.json records their size. Compaction copies live frames into
+# fresh segments, publishes new user indexes, then unlinks the old segments;
+# a reader racing with that sees FileNotFoundError and reloads.
+FRAME = struct.Struct("<II")
+LAYOUT_VERSION = 2
+DEFAULT_SHARDS = 16
+SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+COMPACT_DEAD_RATIO = 0.5
+READ_RETRIES = 3
+
+
+def shard_of(user: str, n_shards: int) -> int:
+    h = hashlib.blake2b(user.encode("utf-8"), digest_size=4).digest()
+    return int.from_bytes(h, "little") % n_shards
+
+
+def user_file(user: str) -> str:
+    # Hashed so any user id is a safe (and case-distinct) file name
+    return hashlib.blake2b(user.encode("utf-8"), digest_size=16).hexdigest() + ".json"
+
+
+def category_dir(category: str | None) -> str:
+    return re.sub(r"[^a-z0-9_-]+", "_", (category or "other").lower()) or "other"
+
+
+def segment_category(seg: str) -> str:
+    return seg.split("/", 1)[0]
+
+
+def empty_segments() -> dict:
+    return {"gen": 0, "next_seq": 1, "segments": {}}
+
+
+def read_frame(f, offset: int) -> dict:
+    f.seek(offset)
+    head = f.read(FRAME.size)
+    length, crc = FRAME.unpack(head)
+    payload = f.read(length)
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise ValueError(f"corrupt frame at {offset} in {f.name}")
+    return json.loads(payload)
+
+
+def matches(rec: dict, style: str | None, color: str | None) -> bool:
+    if style is not None and style not in (rec.get("styleHints") or []):
+        return False
+    if color is not None and color not in (rec.get("colorHints") or []):
+        return False
+    return True
+
+
+def _load_json(path: Path) -> dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class ManifestStore:
+    """Per-user manifest records sharded into append-only segment files.
+
+    Any number of processes may query concurrently; mutations and compaction
+    go through ``writer()``, which holds an exclusive lock on the store.
+    """
+
+    def __init__(self, root: Path, n_shards: int = DEFAULT_SHARDS):
+        self.root = root
+        meta = _load_json(root / "store.json")
+        if meta is None:
+            root.mkdir(parents=True, exist_ok=True)
+            meta = {"shards": n_shards, "layout": LAYOUT_VERSION}
+            _atomic_write(root / "store.json", json.dumps(meta).encode("utf-8"))
+        if meta.get("layout", 1) != LAYOUT_VERSION:
+            raise SystemExit(f"{root} uses store layout {meta.get('layout', 1)}; re-ingest into a new store")
+        self.n_shards = meta["shards"]
+
+    def shard_dir(self, shard: int) -> Path:
+        return self.root / f"shard-{shard:02x}"
+
+    def user_path(self, user: str) -> Path:
+        return self.shard_dir(shard_of(user, self.n_shards)) / "users" / user_file(user)
+
+    def load_segments(self, shard: int) -> dict:
+        return _load_json(self.shard_dir(shard) / "segments.json") or empty_segments()
+
+    def load_user(self, user: str) -> dict[str, list]:
+        doc = _load_json(self.user_path(user))
+        return doc["items"] if doc is not None else {}
+
+    def query(
+        self,
+        user: str,
+        category: str | None = None,
+        style: str | None = None,
+        color: str | None = None,
+    ) -> list[dict]:
+        shard = shard_of(user, self.n_shards)
+        want_dir = category_dir(category) if category is not None else None
+        for attempt in range(READ_RETRIES):
+            by_segment: dict[str, list[int]] = {}
+            for seg, off, _n in self.load_user(user).values():
+                # Segments are per category, so the category filter costs no reads
+                if want_dir is None or segment_category(seg) == want_dir:
+                    by_segment.setdefault(seg, []).append(off)
+            try:
+                return self._read(shard, by_segment, category, style, color)
+            except FileNotFoundError:
+                # Compacted away between reading the index and opening the segment
+                if attempt == READ_RETRIES - 1:
+                    raise
+        return []
+
+    def _read(self, shard: int, by_segment: dict[str, list[int]], category, style, color) -> list[dict]:
+        out = []
+        base = self.shard_dir(shard)
+        for seg in sorted(by_segment):
+            with open(base / seg, "rb") as f:
+                for off in sorted(by_segment[seg]):
+                    rec = read_frame(f, off)["item"]
+                    METRICS.add("store_frames_read")
+                    if category is not None and rec.get("category") != category:
+                        continue
+                    if matches(rec, style, color):
+                        out.append(rec)
+        return out
+
+    def shard_users(self, shard: int) -> dict[str, dict[str, list]]:
+        out = {}
+        users_dir = self.shard_dir(shard) / "users"
+        if not users_dir.is_dir():
+            return out
+        for path in users_dir.glob("*.json"):
+            doc = _load_json(path)
+            if doc is not None:
+                out[doc["user"]] = doc["items"]
+        return out
+
+    def users(self) -> list[str]:
+        names = []
+        for shard in range(self.n_shards):
+            names.extend(self.shard_users(shard))
+        return sorted(names)
+
+    @contextlib.contextmanager
+    def writer(self):
+        lock_path = self.root / "LOCK"
+        with open(lock_path, "a+") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            w = StoreWriter(self)
+            try:
+                yield w
+                w.commit()
+            finally:
+                w.close()
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+class StoreWriter:
+    """Buffered mutations for one writer session; ``commit()`` publishes them.
+
+    Only shards and users touched by the session are loaded and republished.
+    """
+
+    def __init__(self, store: ManifestStore):
+        self.store = store
+        self._segments: dict[int, dict] = {}
+        self._users: dict[str, dict[str, list]] = {}
+        self._dirty_shards: set[int] = set()
+        self._dirty_users: set[str] = set()
+        self._open: dict[tuple[int, str], tuple[str, object]] = {}
+        self._retired: list[tuple[int, list[str]]] = []
+
+    def _shard(self, shard: int) -> dict:
+        meta = self._segments.get(shard)
+        if meta is None:
+            meta = self._segments[shard] = self.store.load_segments(shard)
+        return meta
+
+    def _items(self, user: str) -> dict[str, list]:
+        items = self._users.get(user)
+        if items is None:
+            items = self._users[user] = self.store.load_user(user)
+        return items
+
+    def _touch(self, shard: int, user: str) -> None:
+        self._dirty_shards.add(shard)
+        self._dirty_users.add(user)
+
+    def _segment_for(self, shard: int, cat: str, meta: dict):
+        cur = self._open.get((shard, cat))
+        if cur is not None and meta["segments"][cur[0]]["size"] < SEGMENT_MAX_BYTES:
+            return cur
+        if cur is not None:
+            cur[1].close()
+        # Reuse the newest segment of this category while it has room
+        seg = None
+        for name, info in meta["segments"].items():
+            if segment_category(name) == cat and info["size"] < SEGMENT_MAX_BYTES:
+                if seg is None or name > seg:
+                    seg = name
+        if seg is None:
+            seg = f"{cat}/{meta['next_seq']:08d}.seg"
+            meta["next_seq"] += 1
+            meta["segments"][seg] = {"size": 0, "live": 0}
+        path = self.store.shard_dir(shard) / seg
+        path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(path, "ab")
+        # Drop any torn tail a crashed writer left past the published size
+        f.truncate(meta["segments"][seg]["size"])
+        f.seek(0, os.SEEK_END)
+        self._open[(shard, cat)] = (seg, f)
+        return seg, f
+
+    def _append(self, shard: int, cat: str, payload: dict) -> tuple[str, int, int]:
+        meta = self._shard(shard)
+        seg, f = self._segment_for(shard, cat, meta)
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        off = meta["segments"][seg]["size"]
+        f.write(FRAME.pack(len(data), zlib.crc32(data)))
+        f.write(data)
+        n = FRAME.size + len(data)
+        meta["segments"][seg]["size"] = off + n
+        METRICS.add("bytes_written", n)
+        return seg, off, n
+
+    def _kill(self, meta: dict, loc: list | None) -> None:
+        if loc is None:
+            return
+        seg, _off, n = loc
+        info = meta["segments"].get(seg)
+        if info is not None:
+            info["live"] -= n
+
+    def put(self, user: str, rec: dict) -> None:
+        shard = shard_of(user, self.store.n_shards)
+        meta = self._shard(shard)
+        items = self._items(user)
+        iid = item_id(rec)
+        seg, off, n = self._append(shard, category_dir(rec.get("category")), {"user": user, "item": rec})
+        self._kill(meta, items.get(iid))
+        items[iid] = [seg, off, n]
+        meta["segments"][seg]["live"] += n
+        self._touch(shard, user)
+
+    def delete(self, user: str, iid: str) -> bool:
+        shard = shard_of(user, self.store.n_shards)
+        loc = self._items(user).pop(iid, None)
+        if loc is None:
+            return False
+        self._kill(self._shard(shard), loc)
+        self._touch(shard, user)
+        return True
+
+    def records(self, user: str) -> dict[str, dict]:
+        # Reads through this session's index, including unpublished appends
+        for _, f in self._open.values():
+            f.flush()
+        out = {}
+        base = self.store.shard_dir(shard_of(user, self.store.n_shards))
+        for iid, (seg, off, _n) in self._items(user).items():
+            with open(base / seg, "rb") as f:
+                out[iid] = read_frame(f, off)["item"]
+        return out
+
+    def replace_user(self, user: str, records: list[dict]) -> tuple[int, int]:
+        # Make the user's wardrobe exactly ``records``; unchanged items are not rewritten
+        existing = self.records(user)
+        wanted = {item_id(r): r for r in records}
+        written = 0
+        for iid, rec in wanted.items():
+            if existing.get(iid) != rec:
+                self.put(user, rec)
+                written += 1
+        removed = 0
+        for iid in existing:
+            if iid not in wanted:
+                removed += self.delete(user, iid)
+        return written, removed
+
+    def compact(self, shard: int, force: bool = False) -> bool:
+        meta = self._shard(shard)
+        total = sum(s["size"] for s in meta["segments"].values())
+        live = sum(s["live"] for s in meta["segments"].values())
+        if not total or (not force and (total - live) / total < COMPACT_DEAD_RATIO):
+            return False
+        for _, f in self._open.values():
+            f.flush()
+        base = self.store.shard_dir(shard)
+        # Every user of the shard, with this session's unpublished changes on top
+        users = self.store.shard_users(shard)
+        users.update({u: items for u, items in self._users.items() if shard_of(u, self.store.n_shards) == shard})
+        new = empty_segments()
+        new["gen"] = meta["gen"]
+        new["next_seq"] = meta["next_seq"]
+        # Also sweep segment files an interrupted compaction left unnamed
+        old_segments = sorted({*meta["segments"], *(p.relative_to(base).as_posix() for p in base.glob("*/*.seg"))})
+        # Rewrite live frames into fresh segments; readers keep using the
+        # published user indexes (and the old files) until commit()
+        self._close_shard(shard)
+        self._segments[shard] = new
+        for user, items in sorted(users.items()):
+            self._users[user] = {}
+            self._dirty_users.add(user)
+            by_seg: dict[str, list[int]] = {}
+            for seg, off, _n in items.values():
+                by_seg.setdefault(seg, []).append(off)
+            for seg, offs in sorted(by_seg.items()):
+                with open(base / seg, "rb") as f:
+                    for off in sorted(offs):
+                        self.put(user, read_frame(f, off)["item"])
+        self._dirty_shards.add(shard)
+        self._retired.append((shard, old_segments))
+        METRICS.add("store_compactions")
+        return True
+
+    def _close_shard(self, shard: int) -> None:
+        for key in [k for k in self._open if k[0] == shard]:
+            self._open.pop(key)[1].close()
+
+    def commit(self) -> None:
+        for _, f in self._open.values():
+            f.flush()
+            os.fsync(f.fileno())
+        # segments.json goes first: a published user index must never point
+        # past the size a later writer truncates a segment back to. A crash
+        # before the user indexes land leaves "live" off, so it only steers
+        # compaction; segments are unlinked by compaction alone.
+        for shard in sorted(self._dirty_shards):
+            meta = self._segments[shard]
+            meta["gen"] += 1
+            _atomic_write(
+                self.store.shard_dir(shard) / "segments.json",
+                json.dumps(meta, separators=(",", ":")).encode("utf-8"),
+            )
+        for user in sorted(self._dirty_users):
+            path = self.store.user_path(user)
+            items = self._users[user]
+            if items:
+                doc = {"user": user, "items": items}
+                _atomic_write(path, json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            else:
+                with contextlib.suppress(FileNotFoundError):
+                    path.unlink()
+        # Only now is it safe to unlink segments no published index names
+        for shard, names in self._retired:
+            keep = self._segments[shard]["segments"]
+            for name in names:
+                if name not in keep:
+                    with contextlib.suppress(FileNotFoundError):
+                        (self.store.shard_dir(shard) / name).unlink()
+        self._retired = []
+        self._dirty_shards.clear()
+        self._dirty_users.clear()
+
+    def close(self) -> None:
+        for _, f in self._open.values():
+            f.close()
+        self._open.clear()
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local multi-user manifest store (sharded, append-only segments)")
+    ap.add_argument("--root", required=True, help="Store directory")
+    ap.add_argument("--shards", type=int, default=DEFAULT_SHARDS, help="Shard count for a new store")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("ingest", help="Replace one user's wardrobe with a manifest")
+    p.add_argument("--user", required=True)
+    p.add_argument("--manifest", required=True, help="manifest.json, items_to_upload.json or a .snap snapshot")
+    p = sub.add_parser("query", help="Print one user's records as JSON lines")
+    p.add_argument("--user", required=True)
+    p.add_argument("--category", default=None)
+    p.add_argument("--style", default=None)
+    p.add_argument("--color", default=None)
+    p = sub.add_parser("delete", help="Remove one item from a user")
+    p.add_argument("--user", required=True)
+    p.add_argument("--id", required=True)
+    p = sub.add_parser("compact", help="Rewrite shards whose segments are mostly dead records")
+    p.add_argument("--force", action="store_true", help="Compact every shard regardless of dead ratio")
+    sub.add_parser("users", help="List users in the store")
+    for p in sub.choices.values():
+        add_metrics_args(p)
+    args = ap.parse_args()
+    configure_metrics(args)
+
+    store = ManifestStore(Path(args.root).expanduser().resolve(), args.shards)
+    if args.cmd == "ingest":
+        with METRICS.stage("read_manifest"):
+            records = load_records(Path(args.manifest).expanduser())
+        with METRICS.stage("ingest"), store.writer() as w:
+            written, removed = w.replace_user(args.user, records)
+        print(f"{args.user}: {len(records)} items ({written} written, {removed} removed)", file=sys.stderr)
+    elif args.cmd == "query":
+        with METRICS.stage("query"):
+            for rec in store.query(args.user, args.category, args.style, args.color):
+                print(json.dumps(rec, ensure_ascii=False))
+    elif args.cmd == "delete":
+        with store.writer() as w:
+            found = w.delete(args.user, args.id)
+        print("deleted" if found else "not found", file=sys.stderr)
+    elif args.cmd == "compact":
+        with METRICS.stage("compact"), store.writer() as w:
+            n = sum(w.compact(s, args.force) for s in range(store.n_shards))
+        print(f"Compacted {n} of {store.n_shards} shards", file=sys.stderr)
+    else:
+        for user in store.users():
+            print(user)
+    METRICS.finish(args.metrics_out)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,14 @@ Script to upload existing clothes to Firebase for a specific user.
 Reads images from public/assets/ and uploads them to Firebase Storage and Firestore.
 """
 
+import argparse
 import os
 import json
 import sys
 from pathlib import Path
 
+from metrics import METRICS, add_metrics_args, configure_metrics
+
 def parse_item_from_filename(filename, category):
     """Extract item info from filename"""
     name = filename.replace('.png', '').replace('.jpg', '').replace('-', ' ').title()
@@ -106,8 +109,14 @@ def scan_assets_folder():
     return items
 
 def main():
+    ap = argparse.ArgumentParser(description="Scan assets and write items_to_upload.json")
+    add_metrics_args(ap)
+    args = ap.parse_args()
+    configure_metrics(args)
+
     print("🔍 Scanning assets folder...")
-    items = scan_assets_folder()
+    with METRICS.stage('scan'):
+        items = scan_assets_folder()
     
     print(f"\n✅ Found {len(items)} items:")
     
@@ -124,11 +133,14 @@ def main():
     
     # Save to JSON for the upload script
     output_file = Path('/Users/aiman/Biz/Aiman/Coding/outfit-generator/tools/items_to_upload.json')
-    with open(output_file, 'w') as f:
-        json.dump(items, f, indent=2)
+    with METRICS.stage('write'):
+        with open(output_file, 'w') as f:
+            json.dump(items, f, indent=2)
+        METRICS.add_file_written(output_file)
     
     print(f"\n💾 Saved items list to: {output_file}")
     print("\n📝 Now create the Node.js upload script to send these to Firebase...")
+    METRICS.finish(args.metrics_out)
 
 if __name__ == '__main__':
     main()